@@ -1,2 +1,4 @@
 import logging
 logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+__version__ = '1.0'
@@ -0,0 +1,385 @@
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+
+import rlp
+from eth_utils import encode_hex, keccak, to_canonical_address
+
+from ethereum_stats.blockrange import (BlockHeader, BlockRange, BODY_PREFIX, HEADER_PREFIX, NUM_LEN_BYTES,
+                                       NUM_SUFFIX)
+
+INDEX_META = 'meta.json'
+SEGMENT_MAGIC = b'EAIX'
+# magic, number of addresses, block the deltas of the postings start from
+SEGMENT_HEADER = struct.Struct('<4sIQ')
+OFFSET = struct.Struct('<Q')
+ADDRESS_LENGTH = 20
+DEFAULT_SEGMENT_BLOCKS = 10000
+# blocks this close to the head are not indexed yet, they may still be reorganised
+DEFAULT_CONFIRMATIONS = 12
+# position of the recipient in the fields of typed transactions
+TYPED_TO_POSITIONS = {1: 4, 2: 5}
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buf, start, end):
+    values = []
+    value = 0
+    shift = 0
+    for b in buf[start:end]:
+        value |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+def transaction_addresses(tx):
+    """
+    Sender and recipient of a transaction, the recipient of a contract creation is the created contract.
+
+    The sender is recovered from the signature with pyethereum, which is only imported when the first transaction is
+    decoded.
+
+    :param tx: transaction as decoded by rlp.decode, a list for legacy transactions and bytes for typed ones
+    :return: (sender, recipient) as 20 byte addresses
+    """
+    from ethereum.utils import ecrecover_to_pub
+
+    if isinstance(tx, list):
+        nonce, to, v, r, s = tx[0], tx[3], tx[6], tx[7], tx[8]
+        v = int.from_bytes(v, byteorder='big')
+        if v >= 35:
+            # EIP-155, the chain id is part of the signed data
+            chain_id = (v - 35) // 2
+            signing_hash = keccak(rlp.encode(tx[:6] + [chain_id, b'', b'']))
+            v -= chain_id * 2 + 8
+        else:
+            signing_hash = keccak(rlp.encode(tx[:6]))
+    else:
+        tx_type = tx[0]
+        if tx_type not in TYPED_TO_POSITIONS:
+            raise ValueError('Unknown transaction type %i' % tx_type)
+        fields = rlp.decode(tx[1:])
+        nonce, to, v, r, s = fields[1], fields[TYPED_TO_POSITIONS[tx_type]], fields[-3], fields[-2], fields[-1]
+        signing_hash = keccak(tx[:1] + rlp.encode(fields[:-3]))
+        v = 27 + int.from_bytes(v, byteorder='big')
+
+    public_key = ecrecover_to_pub(signing_hash, v, int.from_bytes(r, byteorder='big'),
+                                  int.from_bytes(s, byteorder='big'))
+    sender = keccak(public_key)[12:]
+    if to == b'':
+        to = keccak(rlp.encode([sender, nonce]))[12:]
+    return sender, to
+
+
+def canonical_hash(db, blk_nbr):
+    return db.get(HEADER_PREFIX + blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big') + NUM_SUFFIX)
+
+
+def _is_canonical(db, blk_nbr, blk_hash):
+    try:
+        return encode_hex(canonical_hash(db, blk_nbr)) == blk_hash
+    except KeyError:
+        # the chain is now shorter
+        return False
+
+
+def block_addresses(db, blk_nbr):
+    """
+    :return: set of the senders and recipients of the transactions of a block
+    """
+    blk_nbr_big_endian = blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big')
+    blk_hash = db.get(HEADER_PREFIX + blk_nbr_big_endian + NUM_SUFFIX)
+    transactions, _ = rlp.decode(db.get(BODY_PREFIX + blk_nbr_big_endian + blk_hash))[:2]
+    addresses = set()
+    for tx in transactions:
+        addresses.update(transaction_addresses(tx))
+    return addresses
+
+
+class Segment:
+    """
+    Immutable index file of the blocks of a range: sorted 20 byte addresses, the offsets of their postings, and the
+    postings, block numbers encoded as varint deltas. The file is memory mapped, a lookup is a binary search that only
+    touches a few pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.nbr_addresses, self.first_blk_nbr = SEGMENT_HEADER.unpack_from(self.buf, 0)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError('%s is not an address index segment' % path)
+        self.keys_start = SEGMENT_HEADER.size
+        self.offsets_start = self.keys_start + self.nbr_addresses * ADDRESS_LENGTH
+        self.postings_start = self.offsets_start + (self.nbr_addresses + 1) * OFFSET.size
+
+    @staticmethod
+    def write(path, first_blk_nbr, postings):
+        """
+        :param postings: iterable of (address, sorted block numbers) sorted by address
+        """
+        keys = bytearray()
+        offsets = array('Q', [0])
+        postings_path = path + '.postings.tmp'
+        with open(postings_path, 'wb') as f:
+            position = 0
+            for address, blk_nbrs in postings:
+                encoded = bytearray()
+                previous = first_blk_nbr
+                for blk_nbr in blk_nbrs:
+                    encode_varint(blk_nbr - previous, encoded)
+                    previous = blk_nbr
+                f.write(encoded)
+                position += len(encoded)
+                keys += address
+                offsets.append(position)
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(keys) // ADDRESS_LENGTH, first_blk_nbr))
+            f.write(keys)
+            f.write(offsets.tobytes())
+            with open(postings_path, 'rb') as postings_file:
+                shutil.copyfileobj(postings_file, f)
+        os.remove(postings_path)
+        os.replace(tmp_path, path)
+
+    def _key(self, i):
+        start = self.keys_start + i * ADDRESS_LENGTH
+        return self.buf[start:start + ADDRESS_LENGTH]
+
+    def _postings(self, i):
+        start = OFFSET.unpack_from(self.buf, self.offsets_start + i * OFFSET.size)[0]
+        end = OFFSET.unpack_from(self.buf, self.offsets_start + (i + 1) * OFFSET.size)[0]
+        blk_nbrs = []
+        blk_nbr = self.first_blk_nbr
+        for delta in decode_varints(self.buf, self.postings_start + start, self.postings_start + end):
+            blk_nbr += delta
+            blk_nbrs.append(blk_nbr)
+        return blk_nbrs
+
+    def lookup(self, address):
+        """
+        :param address: 20 byte address
+        :return: sorted block numbers, empty if the address is not in the segment
+        """
+        low, high = 0, self.nbr_addresses
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < address:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.nbr_addresses and self._key(low) == address:
+            return self._postings(low)
+        return []
+
+    def __iter__(self):
+        for i in range(self.nbr_addresses):
+            yield self._key(i), self._postings(i)
+
+    def close(self):
+        self.buf.close()
+
+
+class AddressIndex:
+    """
+    On disk index of the blocks whose transactions were sent by or to an address.
+
+    The index is a list of segments covering consecutive block ranges, update appends segments for the new blocks of
+    the chain. A segment is merged with the previous one when that one is not larger, so the number of segments stays
+    logarithmic in the size of the index. The canonical hash of the last block of every indexed range is kept as a
+    checkpoint, also once merged, so a reorganisation only drops the blocks after the last checkpoint still canonical
+    and indexes them again.
+    """
+
+    def __init__(self, index_dir):
+        """
+        :param index_dir: directory of the index, created if it does not exist
+        :type index_dir: str
+        """
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        meta_path = os.path.join(index_dir, INDEX_META)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.segments_meta = json.load(f)['segments']
+        else:
+            self.segments_meta = []
+        self._segments = dict()
+
+    @property
+    def next_blk_nbr(self):
+        """
+        First block not indexed yet.
+        """
+        return self.segments_meta[-1]['upper'] + 1 if self.segments_meta else 0
+
+    def _segment(self, meta):
+        segment = self._segments.get(meta['file'])
+        if segment is None:
+            segment = self._segments[meta['file']] = Segment(os.path.join(self.index_dir, meta['file']))
+        return segment
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.index_dir, INDEX_META)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'segments': self.segments_meta}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _remove_segments(self, segments_meta):
+        for meta in segments_meta:
+            segment = self._segments.pop(meta['file'], None)
+            if segment is not None:
+                segment.close()
+            os.remove(os.path.join(self.index_dir, meta['file']))
+
+    def _add_segment(self, lower, upper, postings, checkpoints):
+        """
+        :param checkpoints: list of [block number, canonical hash] of the last block of every range of the segment
+        """
+        name = 'segment-%012i-%012i.idx' % (lower, upper)
+        Segment.write(os.path.join(self.index_dir, name), lower, postings)
+        self.segments_meta.append({'file': name, 'lower': lower, 'upper': upper, 'checkpoints': checkpoints})
+
+    def _merge_last(self, nbr_segments):
+        merged = self.segments_meta[-nbr_segments:]
+        lower, upper = merged[0]['lower'], merged[-1]['upper']
+        streams = [iter(self._segment(meta)) for meta in merged]
+
+        def postings():
+            current, blk_nbrs = None, []
+            for address, segment_blk_nbrs in heapq.merge(*streams, key=lambda item: item[0]):
+                if address != current:
+                    if current is not None:
+                        yield current, blk_nbrs
+                    current, blk_nbrs = address, []
+                blk_nbrs.extend(segment_blk_nbrs)
+            if current is not None:
+                yield current, blk_nbrs
+
+        checkpoints = [checkpoint for meta in merged for checkpoint in meta['checkpoints']]
+        del self.segments_meta[-nbr_segments:]
+        self._add_segment(lower, upper, postings(), checkpoints)
+        self._save_meta()
+        self._remove_segments(merged)
+        logging.info('Merged %i index segments of blocks %i to %i', nbr_segments, lower, upper)
+
+    def _truncate_last(self, nbr_checkpoints):
+        """
+        Rewrite the last segment with only the blocks up to its checkpoint nbr_checkpoints.
+        """
+        meta = self.segments_meta[-1]
+        checkpoints = meta['checkpoints'][:nbr_checkpoints]
+        upper = checkpoints[-1][0]
+        postings = ((address, [blk_nbr for blk_nbr in blk_nbrs if blk_nbr <= upper])
+                    for address, blk_nbrs in self._segment(meta))
+        self.segments_meta.pop()
+        self._add_segment(meta['lower'], upper, ((address, blk_nbrs) for address, blk_nbrs in postings if blk_nbrs),
+                          checkpoints)
+        self._save_meta()
+        self._remove_segments([meta])
+
+    def _drop_reorganised(self, db):
+        while self.segments_meta:
+            meta = self.segments_meta[-1]
+            # canonical hashes commit to their ancestors, the blocks up to a canonical checkpoint are still valid
+            nbr_valid = len(meta['checkpoints'])
+            while nbr_valid > 0 and not _is_canonical(db, *meta['checkpoints'][nbr_valid - 1]):
+                nbr_valid -= 1
+            if nbr_valid == len(meta['checkpoints']):
+                break
+            if nbr_valid > 0:
+                logging.warning('Blocks %i to %i reorganised, truncating their index segment',
+                                meta['checkpoints'][nbr_valid - 1][0] + 1, meta['upper'])
+                self._truncate_last(nbr_valid)
+                break
+            logging.warning('Blocks %i to %i reorganised, dropping their index segment', meta['lower'], meta['upper'])
+            self.segments_meta.pop()
+            self._save_meta()
+            self._remove_segments([meta])
+
+    def update(self, db, upper_blk_nbr=None, confirmations=DEFAULT_CONFIRMATIONS,
+               segment_blocks=DEFAULT_SEGMENT_BLOCKS):
+        """
+        Index the blocks after the last indexed one.
+
+        :param upper_blk_nbr: last block to index, the latest block minus confirmations by default
+        :param segment_blocks: blocks per new segment, bounds the memory used while indexing
+        :return: number of blocks indexed
+        """
+        if getattr(db, 'is_remote', False):
+            raise ValueError('Indexing needs a local database')
+        if upper_blk_nbr is None:
+            upper_blk_nbr = BlockHeader.get_latest_block_header_number(db) - confirmations
+        self._drop_reorganised(db)
+
+        first_blk_nbr = self.next_blk_nbr
+        for lower in range(first_blk_nbr, upper_blk_nbr + 1, segment_blocks):
+            upper = min(lower + segment_blocks - 1, upper_blk_nbr)
+            postings = dict()
+            for blk_nbr in range(lower, upper + 1):
+                for address in block_addresses(db, blk_nbr):
+                    postings.setdefault(address, []).append(blk_nbr)
+            self._add_segment(lower, upper, sorted(postings.items()), [[upper, encode_hex(canonical_hash(db, upper))]])
+            self._save_meta()
+            logging.info('Indexed blocks %i to %i, %i addresses', lower, upper, len(postings))
+
+            while len(self.segments_meta) >= 2 and (
+                    os.path.getsize(os.path.join(self.index_dir, self.segments_meta[-2]['file'])) <=
+                    os.path.getsize(os.path.join(self.index_dir, self.segments_meta[-1]['file']))):
+                self._merge_last(2)
+        return max(0, upper_blk_nbr - first_blk_nbr + 1)
+
+    def compact(self, db):
+        """
+        Merge all the segments in one, after dropping the reorganised blocks.
+        """
+        self._drop_reorganised(db)
+        if len(self.segments_meta) > 1:
+            self._merge_last(len(self.segments_meta))
+
+    def blocks(self, address):
+        """
+        :param address: hex address
+        :return: sorted numbers of the blocks with transactions sent by or to the address
+        """
+        address = to_canonical_address(address)
+        blk_nbrs = []
+        for meta in self.segments_meta:
+            blk_nbrs.extend(self._segment(meta).lookup(address))
+        return blk_nbrs
+
+    def block_range(self, db, address):
+        """
+        :return: BlockRange of the blocks of the address, None if it has none
+        """
+        blk_nbrs = self.blocks(address)
+        if not blk_nbrs:
+            return None
+        return BlockRange.from_block_numbers(db, blk_nbrs)
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = dict()
@@ -0,0 +1,249 @@
+import heapq
+import math
+from collections import Counter
+
+
+class Aggregator:
+    """
+    Streaming aggregation over the accounts of a state.
+
+    Aggregators only keep a bounded summary of the values seen. Two aggregators of the same kind can be merged, so the
+    shards of a walk can be aggregated separately and combined afterwards.
+    """
+
+    def __init__(self, field, name=None):
+        """
+        :param field: attribute of Account to aggregate, for instance balance, nonce or is_contract
+        :type field: str
+        :type name: str
+        """
+        self.field = field
+        self.name = name if name is not None else '%s_%s' % (type(self).__name__.lower(), field)
+
+    def update(self, account):
+        self.add(getattr(account, self.field), account)
+
+    def add(self, value, account):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def _check_mergeable(self, other):
+        if type(other) is not type(self) or other.field != self.field:
+            raise ValueError('Cannot merge %s with %s' % (self.name, other.name))
+
+
+class Count(Aggregator):
+    """
+    Number of accounts, or number of accounts with a truthy field when a field is given.
+    """
+
+    def __init__(self, field=None, name=None):
+        super().__init__(field, name if name is not None or field is not None else 'count')
+        self.count = 0
+
+    def update(self, account):
+        if self.field is None or getattr(account, self.field):
+            self.count += 1
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self.count += other.count
+        return self
+
+    def result(self):
+        return self.count
+
+
+class Sum(Aggregator):
+    """
+    Exact sum of an integer field, big integers never lose precision.
+    """
+
+    def __init__(self, field, name=None):
+        super().__init__(field, name)
+        self.total = 0
+
+    def add(self, value, account):
+        self.total += value
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self.total += other.total
+        return self
+
+    def result(self):
+        return self.total
+
+
+class LogHistogram(Aggregator):
+    """
+    Histogram of a non negative integer field with power of two buckets, bucket n counts the values in
+    [2 ** (n - 1), 2 ** n) and bucket 0 the zeros.
+    """
+
+    def __init__(self, field, name=None):
+        super().__init__(field, name)
+        self.counts = Counter()
+
+    def add(self, value, account):
+        self.counts[int(value).bit_length()] += 1
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        self.counts.update(other.counts)
+        return self
+
+    def result(self):
+        """
+        :return: dict of bucket lower bound to count
+        """
+        return {(1 << (n - 1) if n > 0 else 0): self.counts[n] for n in sorted(self.counts)}
+
+
+class TopK(Aggregator):
+    """
+    The k accounts with the largest value of a field, kept in a bounded heap.
+    """
+
+    def __init__(self, field, k=10, name=None):
+        super().__init__(field, name)
+        self.k = k
+        self.heap = []
+
+    def add(self, value, account):
+        self._push((value, account.address))
+
+    def _push(self, item):
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        for item in other.heap:
+            self._push(item)
+        return self
+
+    def result(self):
+        """
+        :return: list of (address, value) sorted by decreasing value
+        """
+        return [(address, value) for value, address in sorted(self.heap, reverse=True)]
+
+
+class QuantileSketch(Aggregator):
+    """
+    Quantiles of a non negative field with a bounded relative error.
+
+    Values are counted in logarithmic buckets of ratio gamma = (1 + relative_accuracy) / (1 - relative_accuracy), every
+    quantile estimate is within relative_accuracy of a value ranked at that quantile. The number of buckets only grows
+    with the logarithm of the range of the values.
+    """
+
+    def __init__(self, field, relative_accuracy=0.01, quantiles=(0.25, 0.5, 0.75, 0.9, 0.99), name=None):
+        super().__init__(field, name)
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('Relative accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.quantiles = tuple(quantiles)
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zeros = 0
+        self.counts = Counter()
+
+    def bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def bucket_value(self, bucket):
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def add(self, value, account):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.counts[self.bucket(value)] += 1
+
+    def add_array(self, values):
+        """
+        Vectorised add of a numpy array of values.
+        """
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        buckets, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            self.counts[bucket] += count
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.counts.values())
+
+    def merge(self, other):
+        self._check_mergeable(other)
+        if other.gamma != self.gamma:
+            raise ValueError('Cannot merge sketches with different relative accuracy')
+        self.zeros += other.zeros
+        self.counts.update(other.counts)
+        return self
+
+    def quantile(self, q):
+        if not 0 <= q <= 1:
+            raise ValueError('Quantile must be between 0 and 1')
+        count = self.count
+        if count == 0:
+            return math.nan
+        rank = q * (count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if rank < seen:
+                return self.bucket_value(bucket)
+        return self.bucket_value(max(self.counts))
+
+    def result(self):
+        return {q: self.quantile(q) for q in self.quantiles}
+
+
+class Gini(QuantileSketch):
+    """
+    Gini coefficient of a non negative field, computed from the Lorenz curve of the logarithmic buckets of a
+    QuantileSketch. The exact sum of every bucket is kept, only the ordering inside a bucket is approximated.
+    """
+
+    def __init__(self, field, relative_accuracy=0.01, name=None):
+        super().__init__(field, relative_accuracy, (), name)
+        self.sums = Counter()
+
+    def add(self, value, account):
+        super().add(value, account)
+        if value > 0:
+            self.sums[self.bucket(value)] += value
+
+    def merge(self, other):
+        super().merge(other)
+        self.sums.update(other.sums)
+        return self
+
+    def result(self):
+        count = self.count
+        total = sum(self.sums.values())
+        if count == 0 or total == 0:
+            return 0.0
+        area = 0.0
+        cumulative = 0
+        for bucket in sorted(self.counts):
+            previous = cumulative
+            cumulative += self.sums[bucket]
+            # trapezoid of the Lorenz curve over the share of accounts in the bucket
+            area += self.counts[bucket] / count * (previous + cumulative) / total
+        return 1 - area
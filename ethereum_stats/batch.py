@@ -0,0 +1,203 @@
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from eth_utils import remove_0x_prefix
+
+from ethereum_stats import levelDB, workers
+from ethereum_stats.blockrange import BlockHeader, BlockRange
+from ethereum_stats.output import OUTPUT_FORMATS, write_frame
+from ethereum_stats.statedataset import StateDataset
+
+DEFAULT_CHUNK_SIZE = 10000
+HEADERS_TASK = 'headers'
+STATE_TASK = 'state'
+
+log = logging.getLogger(__name__)
+
+
+class JobSpec:
+    def __init__(self, chaindata, output_dir, output_format='csv', workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 block_ranges=(), date_ranges=(), state_roots=(), state_blocks=(), clone_dir=None):
+        """
+        :type chaindata: str | list[str]
+        :type output_dir: str
+        :type output_format: str
+        :type workers: int | None
+        :type chunk_size: int
+        :type block_ranges: list[(int, int)]
+        :type date_ranges: list[(str, str)]
+        :type state_roots: list[str]
+        :type state_blocks: list[int]
+        :type clone_dir: str | None
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format')
+        if chunk_size < 1:
+            raise ValueError('Chunk size must be positive')
+        self.chaindata = [chaindata] if isinstance(chaindata, str) else list(chaindata)
+        if not self.chaindata:
+            raise ValueError('No chaindata directory given')
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.block_ranges = [tuple(r) for r in block_ranges]
+        self.date_ranges = [tuple(r) for r in date_ranges]
+        self.state_roots = list(state_roots)
+        self.state_blocks = list(state_blocks)
+        self.clone_dir = clone_dir
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        try:
+            return cls(**spec)
+        except TypeError as e:
+            raise ValueError('Invalid job spec %s: %s' % (path, e))
+
+
+def plan_tasks(db, spec):
+    """
+    Split a job into independent tasks, state dumps first as they are the longest ones.
+    """
+    tasks = []
+    state_roots = list(spec.state_roots)
+    for blk_nbr in spec.state_blocks:
+        state_roots.append(BlockHeader.get_block_header_by_number(db, blk_nbr).state_root)
+    for state_root in state_roots:
+        tasks.append((STATE_TASK, state_root))
+
+    block_ranges = list(spec.block_ranges)
+    for lower_date, upper_date in spec.date_ranges:
+        blk_range = BlockRange.date_range(db, lower_date, upper_date)
+        block_ranges.append((blk_range.lower_blk_nbr, blk_range.upper_blk_nbr))
+    for lower_blk_nbr, upper_blk_nbr in block_ranges:
+        if lower_blk_nbr > upper_blk_nbr:
+            raise ValueError('Lower limit cannot be greater than upper limit')
+        for chunk_lower in range(lower_blk_nbr, upper_blk_nbr + 1, spec.chunk_size):
+            chunk_upper = min(chunk_lower + spec.chunk_size - 1, upper_blk_nbr)
+            tasks.append((HEADERS_TASK, chunk_lower, chunk_upper))
+
+    return tasks
+
+
+def shard_path(output_dir, output_format, task):
+    if task[0] == STATE_TASK:
+        name = 'state-%s' % remove_0x_prefix(task[1])
+    else:
+        name = 'headers-%012i-%012i' % (task[1], task[2])
+    return os.path.join(output_dir, name + OUTPUT_FORMATS[output_format])
+
+
+def run_task(task, output_dir, output_format):
+    """
+    Execute a task in a pool worker and write its shard. Shards already written by a previous run are skipped.
+
+    :return: (task, number of rows written, seconds spent)
+    """
+    start = time.time()
+    path = shard_path(output_dir, output_format, task)
+    if os.path.exists(path):
+        logging.info('shard %s already exists, skipping', path)
+        return task, 0, time.time() - start
+
+    db = workers.worker_db()
+    if task[0] == STATE_TASK:
+        state = StateDataset(db, task[1])
+        if not state.is_in_db:
+            logging.warning('State root %s not in database, no shard written', task[1])
+            return task, 0, time.time() - start
+        df = state.to_panda_dataframe()
+    else:
+        df = BlockRange(db, task[1], task[2]).to_panda_dataframe()
+    write_frame(df, path, output_format)
+    return task, len(df), time.time() - start
+
+
+def _run_task(args):
+    return run_task(*args)
+
+
+def _pool_size(spec, nbr_tasks):
+    nbr_workers = spec.workers or multiprocessing.cpu_count()
+    if nbr_workers > len(spec.chaindata) and spec.clone_dir is None:
+        log.warning('Only %i chaindata directories for %i workers, set clone_dir to use more workers',
+                    len(spec.chaindata), nbr_workers)
+        nbr_workers = len(spec.chaindata)
+    return max(1, min(nbr_workers, nbr_tasks))
+
+
+def run_job(spec):
+    """
+    Run all the tasks of a job on a process pool, every worker keeps its own database handle open.
+
+    :type spec: JobSpec
+    :return: list with the paths of the shards of the job
+    """
+    os.makedirs(spec.output_dir, exist_ok=True)
+
+    db = levelDB.LevelDB(spec.chaindata[0])
+    tasks = plan_tasks(db, spec)
+    # release the LevelDB lock before the workers open the directory
+    del db
+    gc.collect()
+
+    nbr_workers = _pool_size(spec, len(tasks))
+    chaindata = list(spec.chaindata)
+    clones = []
+    if nbr_workers > len(chaindata):
+        clones = workers.clone_chaindata(chaindata[0], spec.clone_dir, nbr_workers - len(chaindata))
+        chaindata += clones
+    log.info('Running %i tasks on %i workers', len(tasks), nbr_workers)
+
+    chaindata_queue = multiprocessing.Queue()
+    for path in chaindata[:nbr_workers]:
+        chaindata_queue.put(path)
+
+    start = time.time()
+    blocks = 0
+    accounts = 0
+    try:
+        with multiprocessing.Pool(nbr_workers, workers.init_worker, (chaindata_queue,)) as pool:
+            task_args = [(task, spec.output_dir, spec.output_format) for task in tasks]
+            for n, (task, rows, seconds) in enumerate(pool.imap_unordered(_run_task, task_args), 1):
+                if task[0] == STATE_TASK:
+                    accounts += rows
+                else:
+                    blocks += rows
+                elapsed = time.time() - start
+                log.info('%i/%i tasks done, last %s took %.1fs, %i blocks (%.1f/s), %i accounts (%.1f/s)',
+                         n, len(tasks), task, seconds, blocks, blocks / elapsed, accounts, accounts / elapsed)
+    finally:
+        workers.remove_clones(clones)
+
+    log.info('Job finished in %.1fs', time.time() - start)
+    return [shard_path(spec.output_dir, spec.output_format, task) for task in tasks]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract block headers and state dumps from a go-ethereum chaindata '
+                                                 'directory into sharded files.')
+    parser.add_argument('job', help='JSON job spec')
+    parser.add_argument('--workers', type=int, help='number of worker processes, overrides the job spec')
+    parser.add_argument('--log-level', default='INFO', help='progress logging level')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    log.setLevel(args.log_level.upper())
+
+    spec = JobSpec.from_json(args.job)
+    if args.workers is not None:
+        spec.workers = args.workers
+    run_job(spec)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
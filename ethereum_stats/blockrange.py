@@ -1,10 +1,12 @@
+import bisect
+import hashlib
 import logging
 from datetime import datetime
 
-import rlp
-from eth_utils import (encode_hex)
+from eth_utils import (encode_hex, decode_hex, keccak, to_canonical_address)
 
-from ethereum_stats.statedataset import StateDataset
+from ethereum_stats.rlpdecode import header_fields, to_hex, to_int
+from ethereum_stats.triewalk import lookup
 
 HEADER_PREFIX = b'h'
 BODY_PREFIX = b'b'
@@ -12,6 +14,12 @@ BLOCK_HASH_PREFIX = b'H'
 LAST_HEADER_KEY = b'LastHeader'
 NUM_SUFFIX = b'n'
 NUM_LEN_BYTES = 8
+HEADER_FRAME = 'header_frame'
+AGGREGATE_CHUNK_SIZE = 4096
+
+HEADER_COLUMNS = ('number', 'blk_hash', 'parent_hash', 'ommers_hash', 'beneficiary', 'state_root',
+                  'transactions_root', 'receipts_root', 'logs_bloom', 'difficulty', 'gas_limit', 'gas_used',
+                  'timestamp', 'extra_data', 'mix_hash', 'nonce')
 
 date_formats = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y')
 
@@ -49,22 +57,15 @@ class BlockHeader:
 
     @classmethod
     def from_rlp(cls, blk_hash, rlp_data):
-        rlp_fields = rlp.decode(rlp_data)
-        parent_hash = encode_hex(rlp_fields[0]) if rlp_fields[0] != b'' else ''
-        ommers_hash = encode_hex(rlp_fields[1]) if rlp_fields[1] != b'' else ''
-        beneficiary = encode_hex(rlp_fields[2]) if rlp_fields[2] != b'' else ''
-        state_root = encode_hex(rlp_fields[3]) if rlp_fields[3] != b'' else ''
-        transactions_root = encode_hex(rlp_fields[4]) if rlp_fields[4] != b'' else ''
-        receipts_root = encode_hex(rlp_fields[5]) if rlp_fields[5] != b'' else ''
-        logs_bloom = encode_hex(rlp_fields[6]) if rlp_fields[6] != b'' else ''
-        difficulty = int.from_bytes(rlp_fields[7], byteorder='big') if rlp_fields[7] != b'' else -1
-        number = int.from_bytes(rlp_fields[8], byteorder='big') if rlp_fields[8] != b'' else -1
-        gas_limit = int.from_bytes(rlp_fields[9], byteorder='big') if rlp_fields[9] != b'' else 0
-        gas_used = int.from_bytes(rlp_fields[10], byteorder='big') if rlp_fields[10] != b'' else 0
-        timestamp = int.from_bytes(rlp_fields[11], byteorder='big') if rlp_fields[11] != b'' else 0
-        extra_data = encode_hex(rlp_fields[12]) if rlp_fields[12] != b'' else ''
-        mix_hash = encode_hex(rlp_fields[13]) if rlp_fields[13] != b'' else ''
-        nonce = encode_hex(rlp_fields[14]) if rlp_fields[14] != b'' else ''
+        buf, rlp_fields = header_fields(rlp_data)
+        hex_fields = [to_hex(buf, field) if field[1] > field[0] else '' for field in rlp_fields]
+        parent_hash, ommers_hash, beneficiary, state_root, transactions_root, receipts_root, logs_bloom = hex_fields[:7]
+        extra_data, mix_hash, nonce = hex_fields[12:15]
+        difficulty = to_int(buf, rlp_fields[7]) if rlp_fields[7][1] > rlp_fields[7][0] else -1
+        number = to_int(buf, rlp_fields[8]) if rlp_fields[8][1] > rlp_fields[8][0] else -1
+        gas_limit = to_int(buf, rlp_fields[9])
+        gas_used = to_int(buf, rlp_fields[10])
+        timestamp = to_int(buf, rlp_fields[11])
 
         blk_header = cls(blk_hash, parent_hash, ommers_hash,
                          beneficiary, state_root, transactions_root,
@@ -74,8 +75,28 @@ class BlockHeader:
 
         return blk_header
 
+    @classmethod
+    def from_rpc(cls, result):
+        """
+        :param result: block returned by eth_getBlockByNumber
+        :type result: dict
+        """
+        def hex_field(name):
+            return result[name] if result.get(name, '0x') != '0x' else ''
+
+        def int_field(name, default):
+            return int(result[name], 16) if result.get(name, '0x') != '0x' else default
+
+        return cls(result['hash'], hex_field('parentHash'), hex_field('sha3Uncles'),
+                   hex_field('miner'), hex_field('stateRoot'), hex_field('transactionsRoot'),
+                   hex_field('receiptsRoot'), hex_field('logsBloom'), int_field('difficulty', -1),
+                   int_field('number', -1), int_field('gasLimit', 0), int_field('gasUsed', 0),
+                   int_field('timestamp', 0), hex_field('extraData'), hex_field('mixHash'), hex_field('nonce'))
+
     @staticmethod
     def get_block_header_by_number(db, blk_nbr):
+        if getattr(db, 'is_remote', False):
+            return db.get_block_header_by_number(blk_nbr)
         blk_nbr_big_endian = blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big')
         key = HEADER_PREFIX + blk_nbr_big_endian + NUM_SUFFIX
         blk_hash = db.get(key)
@@ -85,6 +106,8 @@ class BlockHeader:
 
     @staticmethod
     def get_latest_block_header_number(db):
+        if getattr(db, 'is_remote', False):
+            return db.get_latest_block_header_number()
         key = LAST_HEADER_KEY
         blk_hash = db.get(key)
         key = BLOCK_HASH_PREFIX + blk_hash
@@ -93,6 +116,8 @@ class BlockHeader:
 
     @staticmethod
     def get_latest_block_header(db):
+        if getattr(db, 'is_remote', False):
+            return db.get_latest_block_header()
         key = LAST_HEADER_KEY
         blk_hash = db.get(key)
         key = BLOCK_HASH_PREFIX + blk_hash
@@ -135,8 +160,12 @@ class BlockRange:
             raise ValueError('Lower limit cannot be greater than upper limit')
         self.db = db
         self.lower_blk_nbr = lower_blk_nbr
-        self.current_blk_nbr = lower_blk_nbr
         self.upper_blk_nbr = upper_blk_nbr
+        # blocks of the range, only some of them for a range made from block numbers
+        self.blk_nbrs = range(lower_blk_nbr, upper_blk_nbr + 1)
+        self.position = 0
+        # headers read ahead in batches from remote sources
+        self.prefetched = []
 
         logging.info('Block range created from %i to %i', self.lower_blk_nbr, self.upper_blk_nbr)
 
@@ -167,20 +196,236 @@ class BlockRange:
         upper_blk_nbr = BlockHeader.get_block_number_by_timestamp(db, upper_date_timestamp, True)
         return BlockRange(db, lower_blk_nbr, upper_blk_nbr)
 
+    @classmethod
+    def from_block_numbers(cls, db, blk_nbrs):
+        """
+        Range of only some blocks, for instance the blocks of an address from ethereum_stats.addressindex. Headers,
+        hashes and aggregations only cover these blocks, account_history covers every block from the first to the last
+        one.
+
+        :param blk_nbrs: block numbers, duplicates are ignored
+        """
+        blk_nbrs = sorted(set(blk_nbrs))
+        if not blk_nbrs:
+            raise ValueError('Block range without blocks')
+        blk_range = cls(db, blk_nbrs[0], blk_nbrs[-1])
+        blk_range.blk_nbrs = blk_nbrs
+        return blk_range
+
+    @property
+    def current_blk_nbr(self):
+        """
+        Number of the next block of the iteration, upper_blk_nbr + 1 once the range is exhausted.
+        """
+        if self.position < len(self.blk_nbrs):
+            return self.blk_nbrs[self.position]
+        return self.upper_blk_nbr + 1
+
+    @current_blk_nbr.setter
+    def current_blk_nbr(self, blk_nbr):
+        self.position = bisect.bisect_left(self.blk_nbrs, blk_nbr)
+        self.prefetched = []
+
+    def _restarted(self):
+        blk_range = BlockRange(self.db, self.lower_blk_nbr, self.upper_blk_nbr)
+        blk_range.blk_nbrs = self.blk_nbrs
+        return blk_range
+
     @staticmethod
     def get_first_state_in_db(db):
+        from ethereum_stats.statedataset import StateDataset
+
         blk = BlockHeader.get_latest_block_header(db)
         state = StateDataset(db, blk.state_root)
         step = -1 * blk.number // 2
         while state.is_in_db:
             blk = BlockHeader.get_block_header_by_number(blk.number + step)
 
+    def block_hashes(self):
+        """
+        Canonical hashes of the blocks of the range, read without decoding the headers.
+        """
+        if getattr(self.db, 'is_remote', False):
+            return [decode_hex(blk.blk_hash) for blk in self._restarted()]
+        return [self.db.get(HEADER_PREFIX + blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big') + NUM_SUFFIX)
+                for blk_nbr in self.blk_nbrs]
+
+    def content_key(self):
+        """
+        Hash identifying the content of the range, it changes if any block of the range is reorganised.
+        """
+        content = hashlib.sha256()
+        for blk_hash in self.block_hashes():
+            content.update(blk_hash)
+        return content.hexdigest()
+
+    def to_panda_dataframe(self, cache=None):
+        """
+        :param cache: the dataframe of a range is computed once and then read from the cache
+        :type cache: ethereum_stats.cache.ResultCache
+        """
+        if cache is not None and not getattr(self.db, 'is_remote', False):
+            content_key = self.content_key()
+            df = cache.get_frame(HEADER_FRAME, content_key)
+            if df is None:
+                df = self._to_panda_dataframe()
+                cache.put_frame(HEADER_FRAME, content_key, df)
+            return df
+        return self._to_panda_dataframe()
+
+    def _to_panda_dataframe(self):
+        import pandas as pd
+
+        records = [vars(blk) for blk in self._restarted()]
+        df = pd.DataFrame.from_records(records, columns=HEADER_COLUMNS, index='number')
+        return df
+
+    def account_history(self, address, exact=False):
+        """
+        Values of an account over the range, one row for the first block and one for every block where it changed.
+
+        The trie path of the account is followed in the state of every resolved block, stopping at the first node
+        already seen in a previous state. Blocks are resolved by bisection, a range is skipped when the account is the
+        same at both ends of it. An account that changes and returns to exactly the same nonce and balance inside a
+        skipped range is missed, use exact to resolve every block instead.
+
+        :type address: str
+        :param exact: resolve every block of the range
+        :return: DataFrame indexed by block number with the columns nonce, balance, storage_root, contract_code and
+        is_in_db, the values are None for blocks whose state is not in the database
+        """
+        import pandas as pd
+        from ethereum_stats.statedataset import Account, BLANK_CODE, BLANK_ROOT
+
+        if getattr(self.db, 'is_remote', False):
+            def resolve(blk_nbr):
+                acc = self.db.get_account(address, blk_nbr)
+                return acc.nonce, acc.balance, acc.storage_root, acc.contract_code, acc.is_in_db
+        else:
+            key = keccak(to_canonical_address(address))
+            known = dict()
+
+            def resolve(blk_nbr):
+                state_root = decode_hex(BlockHeader.get_block_header_by_number(self.db, blk_nbr).state_root)
+                try:
+                    rlp_data = lookup(self.db, state_root, key, known)
+                except KeyError:
+                    logging.warning('State of block %i not in database', blk_nbr)
+                    return None, None, None, None, None
+                if rlp_data is None:
+                    # the values of an absent account, as returned by remote sources
+                    return 0, 0, BLANK_ROOT, BLANK_CODE, False
+                acc = Account.from_rlp(address, rlp_data)
+                return acc.nonce, acc.balance, acc.storage_root, acc.contract_code, True
+
+        changes = {self.lower_blk_nbr: resolve(self.lower_blk_nbr)}
+        if exact:
+            previous = changes[self.lower_blk_nbr]
+            for blk_nbr in range(self.lower_blk_nbr + 1, self.upper_blk_nbr + 1):
+                current = resolve(blk_nbr)
+                if current != previous:
+                    changes[blk_nbr] = current
+                previous = current
+        elif self.upper_blk_nbr > self.lower_blk_nbr:
+            upper_value = resolve(self.upper_blk_nbr)
+            ranges = [(self.lower_blk_nbr, changes[self.lower_blk_nbr], self.upper_blk_nbr, upper_value)]
+            while ranges:
+                lower, lower_value, upper, upper_value = ranges.pop()
+                if lower_value == upper_value:
+                    continue
+                if upper - lower == 1:
+                    changes[upper] = upper_value
+                    continue
+                middle = (lower + upper) // 2
+                middle_value = resolve(middle)
+                ranges.append((middle, middle_value, upper, upper_value))
+                ranges.append((lower, lower_value, middle, middle_value))
+
+        df = pd.DataFrame.from_records([(blk_nbr,) + changes[blk_nbr] for blk_nbr in sorted(changes)],
+                                       columns=('number', 'nonce', 'balance', 'storage_root', 'contract_code',
+                                                'is_in_db'),
+                                       index='number')
+        return df
+
+    def _header_columns(self, blk_nbrs):
+        """
+        Numeric header columns of some blocks, decoded at once from their raw RLP.
+        """
+        import numpy as np
+        from ethereum_stats.rlpdecode import decode_headers
+
+        if getattr(self.db, 'is_remote', False):
+            headers = list(BlockRange.from_block_numbers(self.db, blk_nbrs))
+            return {
+                'timestamp': np.array([blk.timestamp for blk in headers], dtype=np.uint64),
+                'gas_used': np.array([blk.gas_used for blk in headers], dtype=np.uint64),
+                'gas_limit': np.array([blk.gas_limit for blk in headers], dtype=np.uint64),
+                'difficulty': np.array([blk.difficulty for blk in headers], dtype=np.float64),
+                'beneficiary': np.array([blk.beneficiary for blk in headers], dtype=object),
+            }
+        header_rlps = []
+        for blk_nbr in blk_nbrs:
+            blk_nbr_big_endian = blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big')
+            blk_hash = self.db.get(HEADER_PREFIX + blk_nbr_big_endian + NUM_SUFFIX)
+            header_rlps.append(self.db.get(HEADER_PREFIX + blk_nbr_big_endian + blk_hash))
+        return decode_headers(b''.join(header_rlps))
+
+    def aggregate(self, freq='1h', metrics=None, quantiles=(0.5, 0.9), chunk_size=AGGREGATE_CHUNK_SIZE):
+        """
+        Aggregate the headers of the range per time bucket without building a frame of the blocks.
+
+        Headers are decoded chunk_size at a time and every chunk is reduced into the partial state of its buckets, so
+        memory only depends on the number of buckets. The block time of a block is the difference with the timestamp
+        of its parent.
+
+        :param freq: width of the buckets as a pandas timedelta string, e.g. '1h' or '1D'
+        :param metrics: names from ethereum_stats.timebuckets.HEADER_METRICS, all of them by default
+        :param quantiles: quantiles of the numeric metrics, within 1% of the exact values
+        :return: DataFrame indexed by bucket start with the column blocks, the columns <metric>_mean and
+        <metric>_p<quantile> for gas_used, gas_limit, difficulty and block_time, and the column beneficiaries with the
+        number of distinct beneficiaries
+        """
+        import numpy as np
+        import pandas as pd
+        from ethereum_stats.timebuckets import HEADER_METRICS, TimeBuckets
+
+        buckets = TimeBuckets(int(pd.Timedelta(freq).total_seconds()), metrics or HEADER_METRICS, quantiles)
+        previous_blk_nbr = None
+        previous_timestamp = np.nan
+        for start in range(0, len(self.blk_nbrs), chunk_size):
+            blk_nbrs = self.blk_nbrs[start:start + chunk_size]
+            columns = self._header_columns(blk_nbrs)
+            timestamps = columns['timestamp'].astype(np.float64)
+            parent_timestamps = np.concatenate(([previous_timestamp], timestamps[:-1]))
+            # parents outside of the range, only the parent of the first block unless the range is made of some blocks
+            for n, blk_nbr in enumerate(blk_nbrs):
+                if blk_nbr - 1 != (blk_nbrs[n - 1] if n > 0 else previous_blk_nbr):
+                    parent_timestamps[n] = self._parent_timestamp(blk_nbr)
+            columns['block_time'] = timestamps - parent_timestamps
+            buckets.add_chunk(columns)
+            previous_blk_nbr = blk_nbrs[-1]
+            previous_timestamp = timestamps[-1]
+            logging.info('Aggregated headers up to block %i', previous_blk_nbr)
+        return buckets.to_panda_dataframe()
+
+    def _parent_timestamp(self, blk_nbr):
+        if blk_nbr == 0:
+            return float('nan')
+        return BlockHeader.get_block_header_by_number(self.db, blk_nbr - 1).timestamp
+
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.current_blk_nbr > self.upper_blk_nbr:
+        if self.position >= len(self.blk_nbrs):
             raise StopIteration
+        elif getattr(self.db, 'is_remote', False):
+            if not self.prefetched:
+                batch_size = self.db.batch_size * self.db.max_concurrency
+                self.prefetched = self.db.get_block_headers(self.blk_nbrs[self.position:self.position + batch_size])
+                self.prefetched.reverse()
+            self.position += 1
+            return self.prefetched.pop()
         else:
-            self.current_blk_nbr += 1
-            return BlockHeader.get_block_header_by_number(self.db, self.current_blk_nbr - 1)
+            self.position += 1
+            return BlockHeader.get_block_header_by_number(self.db, self.blk_nbrs[self.position - 1])
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+from ethereum_stats import __version__
+
+# bump when the layout of a cached frame changes
+SCHEMA_VERSION = 3
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+META_FILE = 'meta.json'
+FRAME_FILE = 'frame.arrow'
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _touch(path):
+    # the modification time of an entry records its last use for the LRU eviction, set explicitly as the file system
+    # clock can be too coarse to order entries used in quick succession
+    now = time.time()
+    os.utime(path, (now, now))
+
+
+def _is_big_int_column(values):
+    """
+    Object columns of Python integers, such as difficulties, can exceed 64 bits and have no Arrow type.
+    """
+    return values.dtype == object and any(not _is_null(value) for value in values) and all(
+        _is_null(value) or (isinstance(value, int) and not isinstance(value, bool)) for value in values)
+
+
+class ResultCache:
+    """
+    Persistent cache of computed DataFrames keyed by the content they derive from, such as a state root or the hashes
+    of the headers of a range, plus the library and schema versions.
+
+    Every frame is stored as an uncompressed Arrow IPC file and memory mapped back on a hit, with the same columns,
+    dtypes and index as the frame stored. Object columns of integers, which can exceed 64 bits, are stored as decimal
+    strings and converted back. Entries are evicted in least recently used order once the cache grows beyond
+    max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :type cache_dir: str
+        :type max_bytes: int
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(kind, content_key):
+        """
+        :param kind: kind of result, for instance state_frame
+        :param content_key: hash of the content the result is derived from
+        """
+        name = '%s:%s:%s:%i' % (kind, content_key, __version__, SCHEMA_VERSION)
+        return hashlib.sha256(name.encode()).hexdigest()
+
+    def _entry_dir(self, kind, content_key):
+        return os.path.join(self.cache_dir, self.key(kind, content_key))
+
+    def get_frame(self, kind, content_key):
+        """
+        :return: the cached DataFrame, None on a miss
+        """
+        entry_dir = self._entry_dir(kind, content_key)
+        try:
+            with open(os.path.join(entry_dir, META_FILE)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            logging.info('cache miss %s %s', kind, content_key)
+            return None
+        _touch(entry_dir)
+
+        with pa.memory_map(os.path.join(entry_dir, FRAME_FILE)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        # one block per column, so numeric columns are not copied out of the memory map to be consolidated
+        df = table.to_pandas(split_blocks=True)
+        for column in meta['int_columns']:
+            df[column] = pd.Series([None if _is_null(value) else int(value) for value in df[column]], dtype=object,
+                                   index=df.index)
+        logging.info('cache hit %s %s', kind, content_key)
+        return df
+
+    def put_frame(self, kind, content_key, df):
+        entry_dir = self._entry_dir(kind, content_key)
+        tmp_dir = os.path.join(self.cache_dir, 'tmp-' + uuid.uuid4().hex)
+        os.makedirs(tmp_dir)
+
+        int_columns = [column for column in df.columns if _is_big_int_column(df[column])]
+        if int_columns:
+            df = df.assign(**{column: [None if _is_null(value) else str(value) for value in df[column]]
+                              for column in int_columns})
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise ValueError('Frame cannot be cached: %s' % e)
+        # uncompressed, so the columns can be memory mapped back
+        with pa.OSFile(os.path.join(tmp_dir, FRAME_FILE), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump({'kind': kind, 'content_key': content_key, 'int_columns': int_columns}, f)
+
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same entry meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        _touch(entry_dir)
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (last use, size in bytes, path) of the entries of the cache
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('tmp-') or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.info('cache entry %s evicted', path)
+
+    def clear(self):
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
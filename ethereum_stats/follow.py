@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+from eth_utils import encode_hex
+
+from ethereum_stats.blockrange import (BlockHeader, BLOCK_HASH_PREFIX, HEADER_PREFIX, LAST_HEADER_KEY, NUM_LEN_BYTES,
+                                       NUM_SUFFIX)
+
+ADDED = 'added'
+RETRACTED = 'retracted'
+DEFAULT_MAX_REORG_DEPTH = 128
+DEFAULT_POLL_INTERVAL = 1.0
+
+# header is None for retracted blocks
+FollowEvent = namedtuple('FollowEvent', ('kind', 'number', 'blk_hash', 'header'))
+
+
+class BlockFollower:
+    """
+    Follow the canonical chain of a running node, yielding an added event for every new canonical header and a
+    retracted event for every block orphaned by a reorganisation.
+
+    An idle poll only reads the LastHeader key. Reorganisations are detected by checking the parent hash of every new
+    header against the hashes already emitted, the last max_reorg_depth of them are kept in the cursor. With a
+    cursor_path the cursor is saved after every batch of events has been consumed, a restarted follower resumes from it.
+    A batch interrupted before being fully consumed is emitted again.
+    """
+
+    def __init__(self, db, start_blk_nbr=None, cursor_path=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 max_reorg_depth=DEFAULT_MAX_REORG_DEPTH):
+        """
+        :param start_blk_nbr: first block to emit, the block after the latest one by default. Ignored when a saved
+        cursor exists.
+        :type start_blk_nbr: int
+        :type cursor_path: str
+        :type poll_interval: float
+        :type max_reorg_depth: int
+        """
+        self.db = db
+        self.cursor_path = cursor_path
+        self.poll_interval = poll_interval
+        self.max_reorg_depth = max_reorg_depth
+        self.head_token = None
+        # (number, hash) of the last emitted canonical blocks
+        self.emitted = []
+
+        if cursor_path is not None and os.path.exists(cursor_path):
+            with open(cursor_path) as f:
+                cursor = json.load(f)
+            self.next_blk_nbr = cursor['next_blk_nbr']
+            self.emitted = [tuple(blk) for blk in cursor['emitted']]
+            logging.info('Follower resumed at block %i', self.next_blk_nbr)
+        elif start_blk_nbr is not None:
+            self.next_blk_nbr = start_blk_nbr
+        else:
+            self.next_blk_nbr = BlockHeader.get_latest_block_header_number(db) + 1
+
+    def _read_head_token(self):
+        if getattr(self.db, 'is_remote', False):
+            return self.db.get_latest_block_header_number()
+        return self.db.get(LAST_HEADER_KEY)
+
+    def _head_number(self, head_token):
+        if getattr(self.db, 'is_remote', False):
+            return head_token
+        return int.from_bytes(self.db.get(BLOCK_HASH_PREFIX + head_token), byteorder='big')
+
+    def _canonical_hash(self, blk_nbr):
+        if getattr(self.db, 'is_remote', False):
+            return BlockHeader.get_block_header_by_number(self.db, blk_nbr).blk_hash
+        return encode_hex(self.db.get(HEADER_PREFIX + blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big') + NUM_SUFFIX))
+
+    def poll(self):
+        """
+        Check the head of the chain once.
+
+        :return: list of FollowEvent, empty if the head did not move
+        """
+        head_token = self._read_head_token()
+        if head_token == self.head_token:
+            return []
+        head_nbr = self._head_number(head_token)
+        events = []
+
+        while self.emitted:
+            blk_nbr, blk_hash = self.emitted[-1]
+            if blk_nbr <= head_nbr and self._canonical_hash(blk_nbr) == blk_hash:
+                break
+            self.emitted.pop()
+            self.next_blk_nbr = blk_nbr
+            events.append(FollowEvent(RETRACTED, blk_nbr, blk_hash, None))
+            if not self.emitted and len(events) >= self.max_reorg_depth:
+                logging.error('Reorganisation deeper than %i blocks, following from block %i', self.max_reorg_depth,
+                              blk_nbr)
+
+        self.head_token = head_token
+        while self.next_blk_nbr <= head_nbr:
+            header = BlockHeader.get_block_header_by_number(self.db, self.next_blk_nbr)
+            if self.emitted and header.parent_hash != self.emitted[-1][1]:
+                # the canonical chain changed while it was read, it is checked again on the next poll
+                self.head_token = None
+                break
+            events.append(FollowEvent(ADDED, header.number, header.blk_hash, header))
+            self.emitted.append((header.number, header.blk_hash))
+            del self.emitted[:-self.max_reorg_depth]
+            self.next_blk_nbr += 1
+
+        if events:
+            logging.info('Follower at block %i, %i events', self.next_blk_nbr - 1, len(events))
+        return events
+
+    def save_cursor(self):
+        if self.cursor_path is None:
+            return
+        tmp_path = self.cursor_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_blk_nbr': self.next_blk_nbr, 'emitted': self.emitted}, f)
+        os.replace(tmp_path, self.cursor_path)
+
+    def __iter__(self):
+        while True:
+            events = self.poll()
+            for event in events:
+                yield event
+            if events:
+                self.save_cursor()
+            else:
+                time.sleep(self.poll_interval)
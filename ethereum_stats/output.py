@@ -0,0 +1,15 @@
+import os
+
+OUTPUT_FORMATS = {'csv': '.csv', 'pickle': '.pkl', 'parquet': '.parquet'}
+
+
+def write_frame(df, path, output_format):
+    # write to a temporary file first so an interrupted job never leaves truncated shards behind
+    tmp_path = path + '.tmp'
+    if output_format == 'csv':
+        df.to_csv(tmp_path)
+    elif output_format == 'pickle':
+        df.to_pickle(tmp_path)
+    else:
+        df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
@@ -0,0 +1,203 @@
+from itertools import chain
+
+HEADER_NBR_FIELDS = 15
+ACCOUNT_NBR_FIELDS = 4
+
+HEADER_HASH_FIELDS = ('parent_hash', 'ommers_hash', 'state_root', 'transactions_root', 'receipts_root', 'mix_hash')
+HEADER_INT_FIELDS = ('number', 'gas_limit', 'gas_used', 'timestamp')
+HEADER_FIELD_POSITIONS = {'parent_hash': 0, 'ommers_hash': 1, 'beneficiary': 2, 'state_root': 3,
+                          'transactions_root': 4, 'receipts_root': 5, 'logs_bloom': 6, 'difficulty': 7, 'number': 8,
+                          'gas_limit': 9, 'gas_used': 10, 'timestamp': 11, 'extra_data': 12, 'mix_hash': 13,
+                          'nonce': 14}
+
+
+def item_bounds(buf, pos):
+    """
+    Decode the prefix of the RLP item starting at pos.
+
+    :return: (is_list, payload start, payload end)
+    """
+    try:
+        b = buf[pos]
+    except IndexError:
+        raise ValueError('RLP item out of bounds at %i' % pos)
+    if b < 0x80:
+        return False, pos, pos + 1
+    if b < 0xb8:
+        start, end = pos + 1, pos + 1 + b - 0x80
+        is_list = False
+    elif b < 0xc0:
+        length_len = b - 0xb7
+        start = pos + 1 + length_len
+        end = start + int.from_bytes(buf[pos + 1:start], byteorder='big')
+        is_list = False
+    elif b < 0xf8:
+        start, end = pos + 1, pos + 1 + b - 0xc0
+        is_list = True
+    else:
+        length_len = b - 0xf7
+        start = pos + 1 + length_len
+        end = start + int.from_bytes(buf[pos + 1:start], byteorder='big')
+        is_list = True
+    if end > len(buf):
+        raise ValueError('RLP item at %i longer than its buffer' % pos)
+    return is_list, start, end
+
+
+def list_fields(buf, pos=0, nbr_fields=None):
+    """
+    Offsets of the items of the RLP list starting at pos. Only the length prefixes are decoded, unlike rlp.decode no
+    field is copied out of the buffer.
+
+    :param nbr_fields: stop after this number of items, the remaining ones are not decoded
+    :return: (list of (start, end) of the payload of every item, end of the list)
+    """
+    is_list, start, end = item_bounds(buf, pos)
+    if not is_list:
+        raise ValueError('RLP list expected at %i' % pos)
+    fields = []
+    pos = start
+    while pos < end and (nbr_fields is None or len(fields) < nbr_fields):
+        _, field_start, field_end = item_bounds(buf, pos)
+        fields.append((field_start, field_end))
+        pos = field_end
+    if nbr_fields is not None and len(fields) < nbr_fields:
+        raise ValueError('RLP list with %i items, %i expected' % (len(fields), nbr_fields))
+    return fields, end
+
+
+def header_fields(rlp_data):
+    """
+    :return: (memoryview of the header, list of (start, end) of its first 15 fields)
+    """
+    buf = memoryview(rlp_data)
+    fields, _ = list_fields(buf, 0, HEADER_NBR_FIELDS)
+    return buf, fields
+
+
+def account_fields(rlp_data):
+    """
+    :return: (memoryview of the account, list of (start, end) of nonce, balance, storage root and code hash)
+    """
+    buf = memoryview(rlp_data)
+    fields, _ = list_fields(buf, 0, ACCOUNT_NBR_FIELDS)
+    return buf, fields
+
+
+def to_int(buf, field):
+    return int.from_bytes(buf[field[0]:field[1]], byteorder='big')
+
+
+def to_hex(buf, field):
+    return '0x' + buf[field[0]:field[1]].hex()
+
+
+def _split(buffer, nbr_fields):
+    """
+    Offsets of the fields of every RLP list concatenated in buffer.
+
+    :return: (array of the buffer bytes, array of shape (lists, nbr_fields, 2) with the bounds of every field)
+    """
+    import numpy as np
+
+    buf = memoryview(buffer)
+    flat_bounds = []
+    pos = 0
+    while pos < len(buf):
+        fields, pos = list_fields(buf, pos, nbr_fields)
+        flat_bounds.extend(chain.from_iterable(fields))
+    bounds = np.array(flat_bounds, dtype=np.int64).reshape(-1, nbr_fields, 2)
+    return np.frombuffer(buf, dtype=np.uint8), bounds
+
+
+def _gather(arr, bounds, width):
+    """
+    Copy fields straight from the buffer into fixed width raw bytes, shorter fields are zero padded. Raw bytes (numpy
+    void) are used rather than S strings, which drop trailing zero bytes when read.
+    """
+    import numpy as np
+
+    out = np.zeros((len(bounds), width), dtype=np.uint8)
+    for n, (start, end) in enumerate(bounds):
+        out[n, :end - start] = arr[start:end]
+    return out.view('V%i' % width).ravel()
+
+
+def _gather_fixed(arr, bounds, width):
+    """
+    Vectorised _gather for fields that all have exactly width bytes, as hashes.
+    """
+    import numpy as np
+
+    if len(bounds) == 0:
+        return np.zeros(0, dtype='V%i' % width)
+    if np.any(bounds[:, 1] - bounds[:, 0] != width):
+        return _gather(arr, bounds, width)
+    window = arr[bounds[:, 0, None] + np.arange(width)]
+    return window.view('V%i' % width).ravel()
+
+
+def _gather_uint(arr, bounds, width):
+    """
+    Big endian unsigned integers right aligned in windows of width bytes, width being a multiple of 8.
+
+    :return: array of shape (fields, width / 8) of 64 bit words, most significant first
+    """
+    import numpy as np
+
+    if np.any(bounds[:, 1] - bounds[:, 0] > width):
+        raise ValueError('Integer field longer than %i bytes' % width)
+    idx = bounds[:, 1, None] - width + np.arange(width)
+    window = arr[np.clip(idx, 0, None)]
+    window[idx < bounds[:, 0, None]] = 0
+    return window.view('>u8').astype(np.uint64)
+
+
+def _to_uint64(arr, bounds):
+    return _gather_uint(arr, bounds, 8).ravel()
+
+
+def _to_float(arr, bounds, width=32):
+    import numpy as np
+
+    words = _gather_uint(arr, bounds, width).astype(np.float64)
+    scale = 2.0 ** (64 * np.arange(width // 8 - 1, -1, -1))
+    return words @ scale
+
+
+def decode_headers(buffer):
+    """
+    Decode many concatenated RLP headers into numpy arrays, one per field.
+
+    Hashes are 32 byte raw values, beneficiaries 20 byte raw values, their tobytes() gives the exact field. Difficulty
+    is a float and the other numeric fields unsigned 64 bit integers. Every column is gathered from the buffer at once,
+    no field is decoded on its own.
+
+    :return: dict of field name to array
+    """
+    arr, bounds = _split(buffer, HEADER_NBR_FIELDS)
+    columns = {}
+    for name in HEADER_HASH_FIELDS:
+        columns[name] = _gather_fixed(arr, bounds[:, HEADER_FIELD_POSITIONS[name]], 32)
+    columns['beneficiary'] = _gather_fixed(arr, bounds[:, HEADER_FIELD_POSITIONS['beneficiary']], 20)
+    for name in HEADER_INT_FIELDS:
+        columns[name] = _to_uint64(arr, bounds[:, HEADER_FIELD_POSITIONS[name]])
+    columns['difficulty'] = _to_float(arr, bounds[:, HEADER_FIELD_POSITIONS['difficulty']])
+    return columns
+
+
+def decode_accounts(buffer):
+    """
+    Decode many concatenated RLP accounts into numpy arrays, one per field.
+
+    Balances are floats as they do not fit in 64 bits, use Account for exact values.
+
+    :return: dict with the arrays nonce, balance, storage_root and code_hash
+    """
+    arr, bounds = _split(buffer, ACCOUNT_NBR_FIELDS)
+    return {
+        'nonce': _to_uint64(arr, bounds[:, 0]),
+        'balance': _to_float(arr, bounds[:, 1]),
+        'storage_root': _gather_fixed(arr, bounds[:, 2], 32),
+        'code_hash': _gather_fixed(arr, bounds[:, 3], 32),
+    }
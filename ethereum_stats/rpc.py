@@ -0,0 +1,241 @@
+import http.client
+import itertools
+import json
+import logging
+import queue
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from eth_utils import to_normalized_address
+
+from ethereum_stats.blockrange import BlockHeader
+from ethereum_stats.statedataset import Account, BLANK_CODE, BLANK_ROOT
+
+ZERO_HASH = '0x' + '00' * 32
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 60
+IPC_READ_SIZE = 65536
+
+
+class RPCError(Exception):
+    def __init__(self, method, error):
+        super().__init__('%s failed: %s' % (method, error))
+        self.method = method
+        self.error = error
+
+
+class HTTPTransport:
+    """
+    Keep-alive HTTP connection to a JSON-RPC endpoint.
+    """
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse(url)
+        connection_cls = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_cls(parsed.hostname, parsed.port, timeout=timeout)
+        self.path = parsed.path or '/'
+
+    def request(self, payload):
+        try:
+            return self._request(payload)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server closed an idle keep-alive connection, retry once on a new one
+            self.connection.close()
+            return self._request(payload)
+
+    def _request(self, payload):
+        self.connection.request('POST', self.path, body=payload, headers={'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise ConnectionError('HTTP %i from JSON-RPC endpoint' % response.status)
+        return json.loads(body.decode())
+
+    def close(self):
+        self.connection.close()
+
+
+class IPCTransport:
+    """
+    Connection to the IPC socket of a node, responses are not framed so they are read until a complete JSON document
+    has been received.
+    """
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.decoder = json.JSONDecoder()
+
+    def request(self, payload):
+        self.socket.sendall(payload)
+        buffer = bytearray()
+        while True:
+            chunk = self.socket.recv(IPC_READ_SIZE)
+            if not chunk:
+                raise ConnectionError('IPC connection closed by the node')
+            buffer += chunk
+            # a document can only be complete when its closing bracket has been received, decoding the bytes before
+            # would reparse the buffer on every chunk and could split a multi-byte character
+            if not buffer.rstrip().endswith((b'}', b']')):
+                continue
+            try:
+                response, _ = self.decoder.raw_decode(buffer.decode().strip())
+                return response
+            except ValueError:
+                continue
+
+    def close(self):
+        self.socket.close()
+
+
+class RPCSource:
+    """
+    Data source reading a running node through JSON-RPC instead of opening its chaindata directory, which is locked
+    while the node runs.
+
+    BlockHeader, BlockRange and StateDataset.get_account accept it in place of a LevelDB. Calls are packed in batch
+    requests of batch_size calls, and up to max_concurrency batches are in flight at once, each one on its own pooled
+    keep-alive connection.
+    """
+    is_remote = True
+
+    def __init__(self, endpoint, batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param endpoint: http(s) URL or path of the IPC socket of the node
+        :type endpoint: str
+        :type batch_size: int
+        :type max_concurrency: int
+        :type timeout: float
+        """
+        if batch_size < 1 or max_concurrency < 1:
+            raise ValueError('Batch size and concurrency must be positive')
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ids = itertools.count()
+        self.ids_lock = threading.Lock()
+        self.connections = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        logging.info('RPC source created for %s', endpoint)
+
+    def _connect(self):
+        if self.endpoint.startswith(('http://', 'https://')):
+            return HTTPTransport(self.endpoint, self.timeout)
+        return IPCTransport(self.endpoint, self.timeout)
+
+    def _send(self, payload):
+        with self.slots:
+            try:
+                transport = self.connections.get_nowait()
+            except queue.Empty:
+                transport = self._connect()
+            try:
+                response = transport.request(json.dumps(payload).encode())
+            except Exception:
+                transport.close()
+                raise
+            self.connections.put(transport)
+        return response
+
+    def _next_ids(self, n):
+        with self.ids_lock:
+            return [next(self.ids) for _ in range(n)]
+
+    def _send_batch(self, calls):
+        ids = self._next_ids(len(calls))
+        payload = [{'jsonrpc': '2.0', 'id': call_id, 'method': method, 'params': list(params)}
+                   for call_id, (method, params) in zip(ids, calls)]
+        response = self._send(payload)
+        if isinstance(response, dict):
+            # a node rejecting the whole batch answers with a single error object
+            raise RPCError('batch', response.get('error'))
+        by_id = {item.get('id'): item for item in response}
+        results = []
+        for call_id, (method, params) in zip(ids, calls):
+            item = by_id.get(call_id)
+            if item is None:
+                raise RPCError(method, 'no response')
+            if item.get('error') is not None:
+                raise RPCError(method, item['error'])
+            results.append(item.get('result'))
+        return results
+
+    def call(self, method, *params):
+        return self.batch([(method, params)])[0]
+
+    def batch(self, calls):
+        """
+        :param calls: list of (method, params)
+        :return: list of results in the order of the calls
+        """
+        calls = list(calls)
+        chunks = [calls[i:i + self.batch_size] for i in range(0, len(calls), self.batch_size)]
+        if len(chunks) == 1:
+            return self._send_batch(chunks[0])
+        results = []
+        for chunk_results in self.executor.map(self._send_batch, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+    @staticmethod
+    def block_tag(blk_nbr):
+        return 'latest' if blk_nbr is None else hex(blk_nbr)
+
+    def get_block_headers(self, blk_nbrs):
+        results = self.batch(('eth_getBlockByNumber', (hex(blk_nbr), False)) for blk_nbr in blk_nbrs)
+        headers = []
+        for blk_nbr, result in zip(blk_nbrs, results):
+            if result is None:
+                raise KeyError('Block %i not found' % blk_nbr)
+            headers.append(BlockHeader.from_rpc(result))
+        return headers
+
+    def get_block_header_by_number(self, blk_nbr):
+        return self.get_block_headers([blk_nbr])[0]
+
+    def get_latest_block_header_number(self):
+        return int(self.call('eth_blockNumber'), 16)
+
+    def get_latest_block_header(self):
+        return BlockHeader.from_rpc(self.call('eth_getBlockByNumber', 'latest', False))
+
+    def get_balances(self, addresses, blk_nbr=None):
+        tag = self.block_tag(blk_nbr)
+        return [int(result, 16) for result in self.batch(('eth_getBalance', (address, tag))
+                                                         for address in addresses)]
+
+    def get_nonces(self, addresses, blk_nbr=None):
+        tag = self.block_tag(blk_nbr)
+        return [int(result, 16) for result in self.batch(('eth_getTransactionCount', (address, tag))
+                                                         for address in addresses)]
+
+    def get_accounts(self, addresses, blk_nbr=None):
+        tag = self.block_tag(blk_nbr)
+        results = self.batch(('eth_getProof', (address, [], tag)) for address in addresses)
+        return [self._account_from_proof(address, result) for address, result in zip(addresses, results)]
+
+    def get_account(self, address, blk_nbr=None):
+        return self.get_accounts([address], blk_nbr)[0]
+
+    @staticmethod
+    def _account_from_proof(address, proof):
+        nonce = int(proof['nonce'], 16)
+        balance = int(proof['balance'], 16)
+        storage_root = proof['storageHash'] if proof['storageHash'] != ZERO_HASH else BLANK_ROOT
+        contract_code = proof['codeHash'] if proof['codeHash'] != ZERO_HASH else BLANK_CODE
+        # the node answers an empty account for addresses not in the state
+        is_in_db = nonce != 0 or balance != 0 or contract_code != BLANK_CODE
+        return Account(to_normalized_address(address), nonce, balance, storage_root, contract_code, is_in_db,
+                       is_in_db)
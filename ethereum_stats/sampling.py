@@ -0,0 +1,202 @@
+import math
+import random
+
+from eth_utils import encode_hex
+
+from ethereum_stats.statedataset import Account
+from ethereum_stats.triewalk import seek
+
+KEY_LENGTH = 32
+DEFAULT_CONFIDENCE = 0.95
+
+
+def z_score(confidence):
+    """
+    Two sided quantile of the standard normal distribution, computed by bisection of erf.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('Confidence must be between 0 and 1')
+    low, high = 0.0, 40.0
+    for n in range(100):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def wilson_interval(successes, n, confidence=DEFAULT_CONFIDENCE):
+    """
+    Wilson score interval of a proportion, it stays inside [0, 1] and is reliable for proportions close to 0 or 1.
+    """
+    z = z_score(confidence)
+    p = successes / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def _keys_for_occupancy(occupancy, depth):
+    """
+    Number of random keys for which a prefix of depth nibbles is shared with one of them with probability occupancy.
+    """
+    if occupancy >= 1:
+        return math.inf
+    return math.log1p(-occupancy) / math.log1p(-16.0 ** -depth)
+
+
+class StateSample:
+    """
+    Accounts at uniformly random positions of the key space of a state.
+
+    Every sample is the first account whose hashed address follows a random key. An account is drawn with a probability
+    proportional to the gap before its key, keys being keccak hashes that gap is independent of the account, so the
+    estimates of the statistics of the accounts are unbiased. The gaps of a given state are uneven though, which adds a
+    variance that does not shrink with the sample: with N accounts the weights of the gaps are those of exponential
+    gaps, a variance of about twice the variance of the field over N. The bounds account for it with an effective
+    sample size 1 / (1 / n + 2 / N), using the estimated number of accounts. It only matters for small states.
+
+    Fields are Account attributes such as balance, nonce or is_contract, or functions of an Account.
+    """
+
+    def __init__(self, accounts, matched_nibbles):
+        """
+        :type accounts: list[Account]
+        :param matched_nibbles: for every sample, length of the longest prefix of its random key shared with a key of
+        the trie
+        """
+        self.accounts = accounts
+        self.matched_nibbles = matched_nibbles
+        self._effective_size = None
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @property
+    def effective_size(self):
+        """
+        Size of a uniform sample without replacement giving the same variance, see the class docstring.
+        """
+        if self._effective_size is None:
+            nbr_accounts = self.estimate_count()[0]
+            self._effective_size = 1 / (1 / len(self) + 2 / max(nbr_accounts, 1))
+        return self._effective_size
+
+    def values(self, field):
+        if callable(field):
+            return [field(account) for account in self.accounts]
+        return [getattr(account, field) for account in self.accounts]
+
+    def mean(self, field, confidence=DEFAULT_CONFIDENCE):
+        """
+        :return: (mean, lower bound, upper bound) with a normal approximation, valid for a few dozen samples or more
+        """
+        values = self.values(field)
+        n = len(values)
+        mean = sum(values) / n
+        if n < 2:
+            return mean, -math.inf, math.inf
+        variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+        half_width = z_score(confidence) * math.sqrt(variance / self.effective_size)
+        return mean, mean - half_width, mean + half_width
+
+    def fraction(self, field, confidence=DEFAULT_CONFIDENCE):
+        """
+        :return: (fraction of accounts with a truthy field, lower bound, upper bound)
+        """
+        fraction = sum(1 for value in self.values(field) if value) / len(self)
+        low, high = wilson_interval(fraction * self.effective_size, self.effective_size, confidence)
+        return fraction, low, high
+
+    def quantile(self, field, q, confidence=DEFAULT_CONFIDENCE):
+        """
+        The bounds are order statistics of the sample, they hold whatever the distribution of the field.
+
+        :return: (quantile, lower bound, upper bound)
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('Quantile must be between 0 and 1')
+        values = sorted(self.values(field))
+        n = len(values)
+        # the sample of effective size m gives the ranks m q +- z sqrt(m q (1 - q)), scaled to the n values
+        half_width = n * z_score(confidence) * math.sqrt(q * (1 - q) / self.effective_size)
+        low_rank = max(0, math.floor(n * q - half_width) - 1)
+        high_rank = min(n - 1, math.ceil(n * q + half_width))
+        return values[min(n - 1, int(n * q))], values[low_rank], values[high_rank]
+
+    def estimate_count(self, confidence=DEFAULT_CONFIDENCE):
+        """
+        Estimate the number of accounts from the density of the branches of the trie.
+
+        The prefix of depth nibbles of a random key is shared with one of N random keys with probability
+        1 - (1 - 16^-depth)^N. That probability is measured and inverted at the depth giving the lowest variance.
+
+        The measured occupancy has two sources of error: the random keys of the sample, n trials, and how the keys of
+        the state happen to fall in the 16^depth prefixes, 16^depth more trials. The bounds are the inverted bounds of
+        the Wilson interval of both, so they do not narrow below the spread of the keys of the state as the sample
+        grows, which dominates for small states.
+
+        :return: (number of accounts, lower bound, upper bound)
+        """
+        n = len(self.matched_nibbles)
+        best = None
+        best_variance = math.inf
+        for depth in range(1, 2 * KEY_LENGTH + 1):
+            hits = sum(1 for matched in self.matched_nibbles if matched >= depth)
+            if hits == 0:
+                break
+            occupancy = hits / n
+            if hits == n:
+                # only a lower bound, used when no depth is partly occupied
+                if best_variance == math.inf:
+                    best = depth, hits
+                continue
+            # relative variance of the estimate by the delta method
+            variance = (1 / n + 16.0 ** -depth) * occupancy / ((1 - occupancy) * math.log1p(-occupancy) ** 2)
+            if variance < best_variance:
+                best, best_variance = (depth, hits), variance
+        # no key shares even the first nibble of a random key with the state, as for states of a few accounts
+        depth, hits = best if best is not None else (1, 0)
+        effective_trials = 1 / (1 / n + 16.0 ** -depth)
+        low, high = wilson_interval(hits / n * effective_trials, effective_trials, confidence)
+        # a fully occupied depth only gives a lower bound, its estimate is the bound of one miss in one more sample
+        occupancy = min(hits / n, 1 - 1 / (n + 1))
+        return (_keys_for_occupancy(occupancy, depth), _keys_for_occupancy(low, depth),
+                _keys_for_occupancy(high, depth))
+
+    def to_panda_dataframe(self):
+        import pandas as pd
+
+        records = [(account.address, account.nonce, float(account.balance), account.is_contract, account.storage_root,
+                    account.contract_code) for account in self.accounts]
+        return pd.DataFrame.from_records(records, columns=('account', 'nonce', 'balance', 'is_contract',
+                                                           'storage_root', 'contract_code'))
+
+
+def sample_state(state, nbr_samples, rng=random, resolve_addresses=True):
+    """
+    :type state: ethereum_stats.statedataset.StateDataset
+    :param rng: source of the random keys, a random.Random with a seed for a reproducible sample
+    :param resolve_addresses: look up the address of every sampled account, otherwise accounts are identified by the
+    hash of their address
+    :rtype: StateSample
+    """
+    if nbr_samples < 1:
+        raise ValueError('At least one sample needed')
+    nodes = dict()
+    accounts = []
+    matched_nibbles = []
+    for n in range(nbr_samples):
+        found = seek(state.db, state.state_root, rng.getrandbits(8 * KEY_LENGTH).to_bytes(KEY_LENGTH, byteorder='big'),
+                     nodes)
+        if found is None:
+            raise ValueError('Cannot sample an empty state')
+        k, rlp_data, matched = found
+        if resolve_addresses:
+            accounts.append(Account.from_trie(state.db, k, rlp_data))
+        else:
+            accounts.append(Account.from_rlp(encode_hex(k), rlp_data))
+        matched_nibbles.append(matched)
+    return StateSample(accounts, matched_nibbles)
@@ -1,17 +1,21 @@
 import logging
 import warnings
 
-import numpy as np
-import pandas as pd
 import rlp
-from eth_utils import (encode_hex, to_canonical_address, decode_hex)
-from ethereum import utils
-from ethereum.trie import Trie
+from eth_utils import (encode_hex, to_canonical_address, decode_hex, keccak)
 
-BLANK_ROOT = encode_hex(utils.sha3rlp(b''))
-BLANK_CODE = encode_hex(utils.sha3(b''))
+from ethereum_stats.rlpdecode import account_fields, to_hex, to_int
+from ethereum_stats.triewalk import BLANK_ROOT_HASH, iter_leaves
+
+# numpy, pandas and pyethereum are slow to import, they are only imported by the methods that need them so that
+# header only workloads start fast
+
+BLANK_ROOT = encode_hex(BLANK_ROOT_HASH)
+# keccak(b'')
+BLANK_CODE = '0xc5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
 BLANK_RLP = rlp.encode(b'')
 ACCOUNT_LENGTH = 42
+STATE_FRAME = 'state_frame'
 
 
 class Account:
@@ -45,17 +49,21 @@ class Account:
             address = encode_hex(k)
             key_in_db = False
             logging.info('secure-key- %s not found', k)
-        rlp_fields = rlp.decode(rlp_data)
-        nonce = int.from_bytes(rlp_fields[0], byteorder='big') if rlp_fields[0] != b'' else 0
-        balance = int.from_bytes(rlp_fields[1], byteorder='big') if rlp_fields[1] != b'' else 0
-        storage_root = encode_hex(rlp_fields[2])
-        contract_code = encode_hex(rlp_fields[3])
-        account = cls(address, nonce, balance, storage_root, contract_code, True, key_in_db)
+        return cls.from_rlp(address, rlp_data, key_in_db)
+
+    @classmethod
+    def from_rlp(cls, address, rlp_data, is_address_in_db=False):
+        buf, rlp_fields = account_fields(rlp_data)
+        nonce = to_int(buf, rlp_fields[0])
+        balance = to_int(buf, rlp_fields[1])
+        storage_root = to_hex(buf, rlp_fields[2])
+        contract_code = to_hex(buf, rlp_fields[3])
+        account = cls(address, nonce, balance, storage_root, contract_code, True, is_address_in_db)
         return account
 
     @classmethod
     def not_found(cls, address):
-        warnings.warn('\n\tAccount %s not found', address)
+        warnings.warn('\n\tAccount %s not found' % address)
         return cls(address=address, is_in_db=False)
 
     @property
@@ -79,6 +87,8 @@ class Account:
         size = 0
 
         if self.is_contract:
+            from ethereum.trie import Trie
+
             try:
                 storage_trie = Trie(db, decode_hex(self.storage_root))
             except KeyError:
@@ -97,15 +107,30 @@ class Account:
 
 
 class StateDataset:
-    def __init__(self, db, state_root):
+    def __init__(self, db, state_root, blk_nbr=None):
+        """
+        :param blk_nbr: block of the state, needed by remote sources that cannot address a state by its root
+        :type blk_nbr: int
+        """
         self.db = db
+        self.blk_nbr = blk_nbr
         if isinstance(state_root, str):
             self.state_root = decode_hex(state_root)
         else:
             self.state_root = state_root
 
+        # the pyethereum trie is only built when it is first used
+        self._trie = None
+        if getattr(db, 'is_remote', False):
+            if blk_nbr is None:
+                raise ValueError('Block number needed for a state of a remote source')
+            self.is_in_db = True
+            logging.info('Remote state created')
+            return
+
         try:
-            self.trie = Trie(db, self.state_root)
+            if self.state_root != BLANK_ROOT_HASH:
+                db.get(self.state_root)
             self.is_in_db = True
         except KeyError:
             self.state_root = None
@@ -114,6 +139,19 @@ class StateDataset:
 
         logging.info('State created')
 
+    @property
+    def trie(self):
+        """
+        Trie of the state, to_dict and to_panda_dataframe walk it, remote sources only serve single accounts.
+        """
+        if getattr(self.db, 'is_remote', False):
+            raise ValueError('Walking the state trie needs a local database')
+        if self._trie is None:
+            from ethereum.trie import Trie
+
+            self._trie = Trie(self.db, self.state_root)
+        return self._trie
+
     def to_dict(self):
         state_dict = dict()
         for k in self.trie:
@@ -125,7 +163,27 @@ class StateDataset:
                                        acc.is_address_in_db)
         return state_dict
 
-    def to_panda_dataframe(self):
+    def to_panda_dataframe(self, cache=None):
+        """
+        :param cache: the dataframe of a state root is computed once and then read from the cache, states not in the
+        database are not cached
+        :type cache: ethereum_stats.cache.ResultCache
+        """
+        if not self.is_in_db:
+            cache = None
+        if cache is not None:
+            df = cache.get_frame(STATE_FRAME, encode_hex(self.state_root))
+            if df is not None:
+                return df
+        df = self._to_panda_dataframe()
+        if cache is not None:
+            cache.put_frame(STATE_FRAME, encode_hex(self.state_root), df)
+        return df
+
+    def _to_panda_dataframe(self):
+        import numpy as np
+        import pandas as pd
+
         trie_dict = self.trie.to_dict()
         size = len(trie_dict)
         dtype = [('sha3_account', np.str, ACCOUNT_LENGTH), ('account', np.str, ACCOUNT_LENGTH), ('nonce', np.float),
@@ -146,12 +204,71 @@ class StateDataset:
 
         return df
 
+    def aggregate(self, aggregators, prefix=(), resolve_addresses=True):
+        """
+        Compute several aggregations in a single streaming pass over the state trie, memory only depends on the
+        aggregators and not on the size of the state.
+
+        The aggregators are updated in place, the ones used on disjoint prefixes can be merged to combine a sharded
+        walk.
+
+        :type aggregators: list[ethereum_stats.aggregators.Aggregator]
+        :param prefix: nibbles of the hashed addresses to visit, all the state by default
+        :param resolve_addresses: look up the address of every account, otherwise accounts are identified by the hash
+        of their address
+        :return: dict of aggregator name to its result
+        """
+        if getattr(self.db, 'is_remote', False):
+            raise ValueError('Aggregation needs a local database')
+        for k, rlp_data in iter_leaves(self.db, self.state_root, prefix):
+            if resolve_addresses:
+                account = Account.from_trie(self.db, k, rlp_data)
+            else:
+                account = Account.from_rlp(encode_hex(k), rlp_data)
+            for aggregator in aggregators:
+                aggregator.update(account)
+        return {aggregator.name: aggregator.result() for aggregator in aggregators}
+
+    def export_storage(self, output_dir, addresses=None, nbr_workers=None, chaindata=None, clone_dir=None,
+                       output_format='parquet'):
+        """
+        Export the storage slots of contracts to columnar files with the columns contract, slot_hash, slot (its
+        preimage when the database has it) and value. See ethereum_stats.storageexport.export_storage.
+
+        :param addresses: contracts to export, all the contracts of the state by default
+        :return: list of files written
+        """
+        from ethereum_stats.storageexport import export_storage
+
+        if getattr(self.db, 'is_remote', False):
+            raise ValueError('Exporting storage needs a local database')
+        return export_storage(self, output_dir, addresses, nbr_workers, chaindata, clone_dir, output_format)
+
+    def sample(self, nbr_samples, seed=None, resolve_addresses=True):
+        """
+        Draw accounts at uniformly random keys of the state, each sample only reads the nodes of one path of the trie.
+        The sample gives estimates with confidence intervals of the statistics of the accounts and of their number, see
+        ethereum_stats.sampling.StateSample.
+
+        :type nbr_samples: int
+        :param seed: seed of the random keys, for a reproducible sample
+        :rtype: ethereum_stats.sampling.StateSample
+        """
+        import random
+        from ethereum_stats.sampling import sample_state
+
+        if getattr(self.db, 'is_remote', False):
+            raise ValueError('Sampling needs a local database')
+        return sample_state(self, nbr_samples, random.Random(seed), resolve_addresses)
+
     def get_account(self, address):
-        key = utils.sha3(to_canonical_address(address))
+        if getattr(self.db, 'is_remote', False):
+            return self.db.get_account(address, self.blk_nbr)
+        key = keccak(to_canonical_address(address))
         try:
             rlp_data = self.trie.get(key)
             acc = Account.from_trie(self.db, key, rlp_data)
         except KeyError:
-            acc = Account.notFound(address)
+            acc = Account.not_found(address)
         return acc
 
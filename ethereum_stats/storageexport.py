@@ -0,0 +1,193 @@
+import logging
+import multiprocessing
+import os
+import time
+
+from eth_utils import decode_hex, encode_hex
+
+from ethereum_stats import workers
+from ethereum_stats.output import OUTPUT_FORMATS, write_frame
+from ethereum_stats.rlpdecode import item_bounds
+from ethereum_stats.statedataset import Account, BLANK_CODE, BLANK_ROOT
+from ethereum_stats.triewalk import estimate_leaf_count, iter_leaves
+
+STORAGE_COLUMNS = ('contract', 'slot_hash', 'slot', 'value')
+DEFAULT_BATCH_SIZE = 100000
+SECURE_KEY_PREFIX = b'secure-key-'
+
+
+def storage_roots(state, addresses=None):
+    """
+    Group the contracts of a state by storage root, contracts with the same storage only need one trie walk.
+
+    :param addresses: contracts to export, all the contracts of the state by default
+    :return: dict of storage root to list of contract addresses
+    """
+    if addresses is not None:
+        accounts = (state.get_account(address) for address in addresses)
+    else:
+        accounts = (Account.from_trie(state.db, k, rlp_data) for k, rlp_data in iter_leaves(state.db, state.state_root))
+
+    roots = dict()
+    for account in accounts:
+        if account.is_in_db and account.contract_code != BLANK_CODE and account.storage_root != BLANK_ROOT:
+            roots.setdefault(account.storage_root, []).append(account.address)
+    return roots
+
+
+def _slot_preimage(db, slot_hash):
+    try:
+        return encode_hex(db.get(SECURE_KEY_PREFIX + slot_hash))
+    except KeyError:
+        return None
+
+
+def _frame(rows):
+    import pandas as pd
+
+    return pd.DataFrame.from_records(rows, columns=STORAGE_COLUMNS)
+
+
+class StorageWriter:
+    """
+    Rows of many storage roots appended to files of batch_size rows, named after the writer and a sequence number.
+    """
+
+    def __init__(self, output_dir, output_format, writer_id=0, batch_size=DEFAULT_BATCH_SIZE):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.writer_id = writer_id
+        self.batch_size = batch_size
+        self.rows = []
+        self.nbr_files = 0
+        self.paths = []
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        name = 'storage-%03i-%05i%s' % (self.writer_id, self.nbr_files, OUTPUT_FORMATS[self.output_format])
+        self.paths.append(os.path.join(self.output_dir, name))
+        write_frame(_frame(self.rows), self.paths[-1], self.output_format)
+        self.nbr_files += 1
+        self.rows = []
+
+    def take_paths(self):
+        """
+        :return: files written since the last call
+        """
+        paths, self.paths = self.paths, []
+        return paths
+
+
+def export_storage_root(db, storage_root, contracts, writer):
+    """
+    Walk one storage trie and append its slots to the writer, one row per slot and contract.
+
+    :type writer: StorageWriter
+    :return: (storage root, number of slots, list of files completed meanwhile)
+    """
+    nbr_slots = 0
+    for slot_hash, rlp_value in iter_leaves(db, decode_hex(storage_root)):
+        _, start, end = item_bounds(rlp_value, 0)
+        value = encode_hex(rlp_value[start:end])
+        slot = _slot_preimage(db, slot_hash)
+        slot_hash = encode_hex(slot_hash)
+        for contract in contracts:
+            writer.append((contract, slot_hash, slot, value))
+        nbr_slots += 1
+    return storage_root, nbr_slots, writer.take_paths()
+
+
+_worker_writer = None
+_flush_barrier = None
+
+
+def _init_export_worker(chaindata_queue, writer_id_queue, flush_barrier, output_dir, output_format, batch_size):
+    global _worker_writer, _flush_barrier
+    workers.init_worker(chaindata_queue)
+    _worker_writer = StorageWriter(output_dir, output_format, writer_id_queue.get(), batch_size)
+    _flush_barrier = flush_barrier
+
+
+def _run_export(args):
+    return export_storage_root(workers.worker_db(), *args, _worker_writer)
+
+
+def _flush_worker(_):
+    # every worker waits for the others, so each of them runs exactly one flush
+    _flush_barrier.wait()
+    _worker_writer.flush()
+    return _worker_writer.take_paths()
+
+
+def export_storage(state, output_dir, addresses=None, nbr_workers=None, chaindata=None, clone_dir=None,
+                   output_format='parquet', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Export the storage slots of the contracts of a state.
+
+    Every distinct storage root is a task, tasks are scheduled largest first on a process pool so the export takes
+    about as long as the largest contract. Every worker appends the rows of its tasks to its own files of batch_size
+    rows, so small contracts do not end up in files of their own.
+
+    :type state: ethereum_stats.statedataset.StateDataset
+    :param chaindata: copies of the chaindata directory for the workers, a LevelDB directory can only be opened by one
+    process
+    :param clone_dir: create hard linked clones of the chaindata of the state for the workers in this directory
+    :return: list of files written
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format')
+    if batch_size < 1:
+        raise ValueError('Batch size must be positive')
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+
+    roots = storage_roots(state, addresses)
+    tasks = sorted(roots.items(), key=lambda item: estimate_leaf_count(state.db, decode_hex(item[0])), reverse=True)
+    logging.info('%i contracts with %i distinct storage roots to export', sum(len(c) for c in roots.values()),
+                 len(roots))
+
+    nbr_workers = min(nbr_workers or multiprocessing.cpu_count(), len(tasks))
+    clones = []
+    if chaindata is None and clone_dir is not None and nbr_workers > 1:
+        chaindata = clones = workers.clone_chaindata(state.db.dbfile, clone_dir, nbr_workers)
+    if chaindata is None or nbr_workers <= 1:
+        if nbr_workers > 1:
+            logging.warning('No chaindata copies for the workers, exporting storage in a single process')
+        writer = StorageWriter(output_dir, output_format, batch_size=batch_size)
+        paths = _collect((export_storage_root(state.db, *args, writer) for args in tasks), len(tasks), start)
+        writer.flush()
+        return paths + writer.take_paths()
+
+    nbr_workers = min(nbr_workers, len(chaindata))
+    chaindata_queue = multiprocessing.Queue()
+    writer_id_queue = multiprocessing.Queue()
+    for writer_id, path in enumerate(chaindata[:nbr_workers]):
+        chaindata_queue.put(path)
+        writer_id_queue.put(writer_id)
+    init_args = (chaindata_queue, writer_id_queue, multiprocessing.Barrier(nbr_workers), output_dir, output_format,
+                 batch_size)
+    try:
+        with multiprocessing.Pool(nbr_workers, _init_export_worker, init_args) as pool:
+            paths = _collect(pool.imap_unordered(_run_export, tasks, chunksize=1), len(tasks), start)
+            for worker_paths in pool.map(_flush_worker, range(nbr_workers), chunksize=1):
+                paths.extend(worker_paths)
+            return paths
+    finally:
+        workers.remove_clones(clones)
+
+
+def _collect(results, nbr_tasks, start):
+    paths = []
+    nbr_slots = 0
+    for n, (storage_root, root_slots, root_paths) in enumerate(results, 1):
+        paths.extend(root_paths)
+        nbr_slots += root_slots
+        logging.info('%i/%i storage roots exported, %s with %i slots, %.1f slots/s', n, nbr_tasks, storage_root,
+                     root_slots, nbr_slots / (time.time() - start))
+    return paths
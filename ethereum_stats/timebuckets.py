@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from ethereum_stats.aggregators import QuantileSketch
+
+NUMERIC_METRICS = ('gas_used', 'gas_limit', 'difficulty', 'block_time')
+HEADER_METRICS = ('blocks',) + NUMERIC_METRICS + ('beneficiaries',)
+DEFAULT_QUANTILES = (0.5, 0.9)
+
+
+class BucketState:
+    """
+    Partial aggregation of the headers of one time bucket.
+    """
+
+    def __init__(self, numeric_metrics, relative_accuracy):
+        self.blocks = 0
+        self.sums = {metric: 0.0 for metric in numeric_metrics}
+        self.counts = {metric: 0 for metric in numeric_metrics}
+        self.sketches = {metric: QuantileSketch(metric, relative_accuracy) for metric in numeric_metrics}
+        self.beneficiaries = set()
+
+    def merge(self, other):
+        self.blocks += other.blocks
+        for metric in self.sums:
+            self.sums[metric] += other.sums[metric]
+            self.counts[metric] += other.counts[metric]
+            self.sketches[metric].merge(other.sketches[metric])
+        self.beneficiaries |= other.beneficiaries
+        return self
+
+
+class TimeBuckets:
+    """
+    Mergeable per time bucket aggregation of header columns.
+
+    Chunks of headers are reduced with vectorised operations and only a BucketState per bucket is kept, so memory
+    depends on the number of buckets and not on the number of headers. Quantiles come from QuantileSketch.
+    """
+
+    def __init__(self, freq_seconds, metrics=HEADER_METRICS, quantiles=DEFAULT_QUANTILES, relative_accuracy=0.01):
+        """
+        :param freq_seconds: width of a bucket, buckets are aligned on multiples of it since the epoch
+        :type freq_seconds: int
+        :param metrics: names from HEADER_METRICS
+        :type quantiles: tuple
+        """
+        unknown = set(metrics) - set(HEADER_METRICS)
+        if unknown:
+            raise ValueError('Unknown metrics %s' % ', '.join(sorted(unknown)))
+        if freq_seconds < 1:
+            raise ValueError('Bucket frequency must be at least one second')
+        self.freq_seconds = freq_seconds
+        self.metrics = tuple(metrics)
+        self.numeric_metrics = tuple(metric for metric in NUMERIC_METRICS if metric in metrics)
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.buckets = dict()
+
+    def _bucket(self, bucket_id):
+        state = self.buckets.get(bucket_id)
+        if state is None:
+            state = self.buckets[bucket_id] = BucketState(self.numeric_metrics, self.relative_accuracy)
+        return state
+
+    def add_chunk(self, columns):
+        """
+        :param columns: dict of header arrays with at least timestamp, plus the columns named by the metrics,
+        block_time being NaN when unknown
+        """
+        bucket_ids = columns['timestamp'].astype(np.int64) // self.freq_seconds
+        order = np.argsort(bucket_ids, kind='stable')
+        bucket_ids = bucket_ids[order]
+        ids, starts = np.unique(bucket_ids, return_index=True)
+        ends = np.append(starts[1:], len(bucket_ids))
+
+        values = {}
+        sums = {}
+        counts = {}
+        for metric in self.numeric_metrics:
+            metric_values = np.asarray(columns[metric], dtype=np.float64)[order]
+            valid = ~np.isnan(metric_values)
+            values[metric] = (metric_values, valid)
+            sums[metric] = np.add.reduceat(np.where(valid, metric_values, 0.0), starts)
+            counts[metric] = np.add.reduceat(valid.astype(np.int64), starts)
+        if 'beneficiaries' in self.metrics:
+            beneficiaries = columns['beneficiary'][order]
+
+        for n, (bucket_id, start, end) in enumerate(zip(ids.tolist(), starts.tolist(), ends.tolist())):
+            state = self._bucket(bucket_id)
+            state.blocks += end - start
+            for metric in self.numeric_metrics:
+                metric_values, valid = values[metric]
+                state.sums[metric] += float(sums[metric][n])
+                state.counts[metric] += int(counts[metric][n])
+                state.sketches[metric].add_array(metric_values[start:end][valid[start:end]])
+            if 'beneficiaries' in self.metrics:
+                state.beneficiaries.update(np.unique(beneficiaries[start:end]).tolist())
+
+    def merge(self, other):
+        if other.freq_seconds != self.freq_seconds or other.metrics != self.metrics:
+            raise ValueError('Cannot merge buckets with different frequency or metrics')
+        for bucket_id, state in other.buckets.items():
+            self._bucket(bucket_id).merge(state)
+        return self
+
+    def to_panda_dataframe(self):
+        """
+        :return: DataFrame indexed by the start of the buckets
+        """
+        bucket_ids = sorted(self.buckets)
+        data = {}
+        if 'blocks' in self.metrics:
+            data['blocks'] = [self.buckets[bucket_id].blocks for bucket_id in bucket_ids]
+        for metric in self.numeric_metrics:
+            data['%s_mean' % metric] = [state.sums[metric] / state.counts[metric] if state.counts[metric] else np.nan
+                                        for state in (self.buckets[bucket_id] for bucket_id in bucket_ids)]
+            for q in self.quantiles:
+                data['%s_p%g' % (metric, q * 100)] = [self.buckets[bucket_id].sketches[metric].quantile(q)
+                                                      for bucket_id in bucket_ids]
+        if 'beneficiaries' in self.metrics:
+            data['beneficiaries'] = [len(self.buckets[bucket_id].beneficiaries) for bucket_id in bucket_ids]
+        index = pd.to_datetime(np.asarray(bucket_ids, dtype=np.int64) * self.freq_seconds, unit='s')
+        df = pd.DataFrame(data, index=index)
+        df.index.name = 'bucket'
+        return df
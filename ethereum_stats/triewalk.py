@@ -0,0 +1,244 @@
+import random
+
+import rlp
+from eth_utils import decode_hex
+
+# keccak(rlp(b'')), the root of an empty trie is never stored in the database
+BLANK_ROOT_HASH = decode_hex('0x56e81f171bcc55a6ff8345e692c0f86e5b48e01b996cadc001622fb5e363b421')
+BRANCH_NODE_LENGTH = 17
+# levels of nodes kept in memory by seek, the top of the trie is read by every seek
+CACHED_NODE_DEPTH = 3
+
+
+def bytes_to_nibbles(data):
+    nibbles = []
+    for b in data:
+        nibbles.append(b >> 4)
+        nibbles.append(b & 0x0f)
+    return tuple(nibbles)
+
+
+def nibbles_to_bytes(nibbles):
+    return bytes(nibbles[i] << 4 | nibbles[i + 1] for i in range(0, len(nibbles), 2))
+
+
+def unpack_path(encoded_path):
+    """
+    Decode the hex prefix encoded path of a leaf or extension node.
+
+    :return: (nibbles, is_leaf)
+    """
+    nibbles = bytes_to_nibbles(encoded_path)
+    flag = nibbles[0]
+    is_leaf = flag >= 2
+    if flag % 2:
+        return nibbles[1:], is_leaf
+    return nibbles[2:], is_leaf
+
+
+def get_node(db, ref):
+    """
+    Resolve a node reference, either the hash of a node stored in the database or a node embedded in its parent.
+
+    :return: decoded node as a list, None for a blank reference
+    """
+    if isinstance(ref, list):
+        return ref
+    if ref == b'' or ref == BLANK_ROOT_HASH:
+        return None
+    return rlp.decode(db.get(ref))
+
+
+def _matches(path, prefix):
+    n = min(len(path), len(prefix))
+    return path[:n] == prefix[:n]
+
+
+def iter_leaves(db, root, prefix=()):
+    """
+    Stream the leaves of a trie in key order without loading it in memory.
+
+    :param prefix: only visit the leaves whose key starts with these nibbles, used to split a walk in shards
+    :return: generator of (key, rlp value)
+    """
+    prefix = tuple(prefix)
+    stack = [(root, ())]
+    while stack:
+        ref, path = stack.pop()
+        node = get_node(db, ref)
+        if node is None:
+            continue
+        if len(node) == BRANCH_NODE_LENGTH:
+            if node[16] != b'' and len(path) >= len(prefix):
+                yield nibbles_to_bytes(path), node[16]
+            for i in range(15, -1, -1):
+                if node[i] != b'':
+                    child_path = path + (i,)
+                    if _matches(child_path, prefix):
+                        stack.append((node[i], child_path))
+        else:
+            nibbles, is_leaf = unpack_path(node[0])
+            child_path = path + nibbles
+            if not _matches(child_path, prefix):
+                continue
+            if is_leaf:
+                yield nibbles_to_bytes(child_path), node[1]
+            else:
+                stack.append((node[1], child_path))
+
+
+def estimate_leaf_count(db, root, probes=8, rng=random):
+    """
+    Estimate the number of leaves of a trie by descending random paths, each probe multiplies the number of children
+    of the branch nodes it crosses (Knuth's tree size estimator). It only reads a few nodes per probe.
+
+    :type probes: int
+    :return: mean of the estimates of the probes
+    """
+    total = 0
+    for n in range(probes):
+        estimate = 1
+        node = get_node(db, root)
+        if node is None:
+            return 0
+        while node is not None:
+            if len(node) == BRANCH_NODE_LENGTH:
+                children = [child for child in node[:16] if child != b'']
+                if node[16] != b'':
+                    # the value of the branch is a leaf of its own, count it as one more child ending here
+                    children.append(None)
+                estimate *= len(children)
+                child = rng.choice(children)
+                node = get_node(db, child) if child is not None else None
+            else:
+                nibbles, is_leaf = unpack_path(node[0])
+                node = None if is_leaf else get_node(db, node[1])
+        total += estimate
+    return total / probes
+
+
+def lookup(db, root, key, known=None):
+    """
+    Get the value of a key following its path from the root.
+
+    :param known: dict of node hash to the value of key in the subtrie of that node. The walk stops at the first node
+    already known and the nodes of the path are added to it, so lookups of the same key in successive versions of a
+    trie only read the nodes that changed.
+    :return: rlp value, None if the key is not in the trie
+    """
+    nibbles = bytes_to_nibbles(key)
+    path_hashes = []
+    value = None
+    ref = root
+    pos = 0
+    while True:
+        if not isinstance(ref, list):
+            if known is not None and ref in known:
+                value = known[ref]
+                break
+            path_hashes.append(ref)
+        node = get_node(db, ref)
+        if node is None:
+            break
+        if len(node) == BRANCH_NODE_LENGTH:
+            if pos == len(nibbles):
+                value = node[16] if node[16] != b'' else None
+                break
+            ref = node[nibbles[pos]]
+            pos += 1
+        else:
+            path, is_leaf = unpack_path(node[0])
+            if nibbles[pos:pos + len(path)] != path:
+                break
+            pos += len(path)
+            if is_leaf:
+                value = node[1] if pos == len(nibbles) else None
+                break
+            ref = node[1]
+
+    if known is not None:
+        for node_hash in path_hashes:
+            known[node_hash] = value
+    return value
+
+
+def _cached_node(db, ref, depth, nodes):
+    if nodes is None or isinstance(ref, list) or depth >= CACHED_NODE_DEPTH:
+        return get_node(db, ref)
+    node = nodes.get(ref)
+    if node is None:
+        node = nodes[ref] = get_node(db, ref)
+    return node
+
+
+def _first_leaf(db, ref, path, nodes):
+    while True:
+        node = _cached_node(db, ref, len(path), nodes)
+        if len(node) == BRANCH_NODE_LENGTH:
+            if node[16] != b'':
+                return nibbles_to_bytes(path), node[16]
+            i = next(i for i in range(16) if node[i] != b'')
+            ref, path = node[i], path + (i,)
+        else:
+            nibbles, is_leaf = unpack_path(node[0])
+            path = path + nibbles
+            if is_leaf:
+                return nibbles_to_bytes(path), node[1]
+            ref = node[1]
+
+
+def seek(db, root, key, nodes=None):
+    """
+    Find the first leaf whose key is greater or equal to key, wrapping around to the first leaf of the trie. Only the
+    nodes of the path of key and of the path of the leaf are read.
+
+    :param nodes: dict caching the nodes of the first CACHED_NODE_DEPTH levels between seeks
+    :return: (leaf key, rlp value, length in nibbles of the longest prefix of key shared with a key of the trie), None
+    for an empty trie
+    """
+    nibbles = bytes_to_nibbles(key)
+    # branches crossed with the first child right of the path of key
+    right = []
+    ref, path = root, ()
+    while True:
+        node = _cached_node(db, ref, len(path), nodes)
+        if node is None:
+            return None
+        pos = len(path)
+        if len(node) == BRANCH_NODE_LENGTH:
+            if pos == len(nibbles):
+                matched = pos
+                if node[16] != b'':
+                    return key, node[16], matched
+                right.append((node, path, 0))
+                break
+            n = nibbles[pos]
+            right.append((node, path, n + 1))
+            if node[n] == b'':
+                matched = pos
+                break
+            ref, path = node[n], path + (n,)
+        else:
+            node_path, is_leaf = unpack_path(node[0])
+            remaining = nibbles[pos:pos + len(node_path)]
+            common = 0
+            while common < len(remaining) and node_path[common] == remaining[common]:
+                common += 1
+            matched = pos + common
+            if is_leaf:
+                if path + node_path >= nibbles:
+                    return nibbles_to_bytes(path + node_path), node[1], matched
+                break
+            if node_path == remaining:
+                ref, path = node[1], path + node_path
+            elif node_path > remaining:
+                return _first_leaf(db, node[1], path + node_path, nodes) + (matched,)
+            else:
+                break
+
+    while right:
+        node, path, start = right.pop()
+        for i in range(start, 16):
+            if node[i] != b'':
+                return _first_leaf(db, node[i], path + (i,), nodes) + (matched,)
+    return _first_leaf(db, root, (), nodes) + (matched,)
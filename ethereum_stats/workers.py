@@ -0,0 +1,65 @@
+import logging
+import os
+import shutil
+
+# LevelDB table files are immutable once written, so clones can share them through hard links
+IMMUTABLE_SUFFIXES = ('.ldb', '.sst')
+
+_worker_db = None
+
+
+def _link_or_copy(src, dst):
+    if src.endswith(IMMUTABLE_SUFFIXES):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            logging.info('cannot hard link %s, copying it', src)
+    return shutil.copy2(src, dst)
+
+
+def clone_chaindata(chaindata, clone_dir, nbr_clones):
+    """
+    Create read-only working copies of a chaindata directory.
+
+    LevelDB locks its directory to a single process, so every worker of a pool needs its own copy. Table files are hard
+    linked, only the small manifest and log files are copied.
+
+    :type chaindata: str
+    :type clone_dir: str
+    :type nbr_clones: int
+    :return: list with the paths of the clones
+    """
+    os.makedirs(clone_dir, exist_ok=True)
+    clones = []
+    for n in range(nbr_clones):
+        clone = os.path.join(clone_dir, 'chaindata-%i' % n)
+        if os.path.isdir(clone):
+            shutil.rmtree(clone)
+        shutil.copytree(chaindata, clone, copy_function=_link_or_copy, ignore=shutil.ignore_patterns('LOCK'))
+        clones.append(clone)
+        logging.info('chaindata %s cloned into %s', chaindata, clone)
+    return clones
+
+
+def remove_clones(clones):
+    for clone in clones:
+        shutil.rmtree(clone, ignore_errors=True)
+
+
+def init_worker(chaindata_queue):
+    """
+    Pool initializer, every worker takes one chaindata path from the queue and keeps it open for its whole life.
+    """
+    from ethereum_stats import levelDB
+
+    global _worker_db
+    chaindata = chaindata_queue.get()
+    _worker_db = levelDB.LevelDB(chaindata)
+    logging.info('worker %i opened %s', os.getpid(), chaindata)
+
+
+def worker_db():
+    if _worker_db is None:
+        raise RuntimeError('Database not opened, the worker was not started with init_worker')
+    return _worker_db
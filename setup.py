@@ -3,4 +3,7 @@ from setuptools import setup
 setup(name='ethereum-analysis-tool',
       version='1.0',
       packages=['ethereum_stats'],
+      entry_points={
+          'console_scripts': ['ethereum-stats-batch=ethereum_stats.batch:main'],
+      },
       )
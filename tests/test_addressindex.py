@@ -0,0 +1,89 @@
+import random
+
+from eth_utils import keccak, to_normalized_address
+
+from ethereum_stats.addressindex import AddressIndex
+from ethereum_stats.blockrange import BODY_PREFIX, HEADER_PREFIX, NUM_LEN_BYTES, NUM_SUFFIX
+
+NBR_RANDOM_TESTS = 5
+
+
+def w3_address_blocks(initial_scenario, upper_blk_nbr):
+    address_blocks = dict()
+    for blk_nbr in range(upper_blk_nbr + 1):
+        for txn in initial_scenario.w3.eth.getBlock(blk_nbr, True)['transactions']:
+            to = txn['to']
+            if to is None:
+                to = initial_scenario.w3.eth.getTransactionReceipt(txn['hash'])['contractAddress']
+            for address in (txn['from'], to):
+                address_blocks.setdefault(to_normalized_address(address), []).append(blk_nbr)
+    return {address: sorted(set(blk_nbrs)) for address, blk_nbrs in address_blocks.items()}
+
+
+class ReorganisedDB:
+    """
+    Database whose blocks from fork_blk_nbr on were replaced by blocks with other hashes and the same transactions.
+    """
+
+    def __init__(self, db, fork_blk_nbr):
+        self.db = db
+        self.fork_blk_nbr = fork_blk_nbr
+
+    def _is_forked(self, key):
+        return int.from_bytes(key[1:1 + NUM_LEN_BYTES], byteorder='big') >= self.fork_blk_nbr
+
+    def get(self, key):
+        if key.startswith(HEADER_PREFIX) and key.endswith(NUM_SUFFIX) and len(key) == NUM_LEN_BYTES + 2 and \
+                self._is_forked(key):
+            return keccak(self.db.get(key))
+        if key.startswith(BODY_PREFIX) and self._is_forked(key):
+            return self.db.get(BODY_PREFIX + key[1:1 + NUM_LEN_BYTES] +
+                               self.db.get(HEADER_PREFIX + key[1:1 + NUM_LEN_BYTES] + NUM_SUFFIX))
+        return self.db.get(key)
+
+
+def test_address_index(initial_scenario, tmpdir):
+    db = initial_scenario.db
+    latest_block_nbr = initial_scenario.get_block()['number']
+    middle_blk_nbr = latest_block_nbr // 2
+    index_dir = str(tmpdir.join('index'))
+
+    index = AddressIndex(index_dir)
+    assert index.update(db, upper_blk_nbr=middle_blk_nbr, segment_blocks=16) == middle_blk_nbr + 1
+    # incremental update of a reopened index
+    index = AddressIndex(index_dir)
+    assert index.next_blk_nbr == middle_blk_nbr + 1
+    assert index.update(db, confirmations=0, segment_blocks=16) == latest_block_nbr - middle_blk_nbr
+    assert index.update(db, confirmations=0) == 0
+
+    address_blocks = w3_address_blocks(initial_scenario, latest_block_nbr)
+    addresses = list(address_blocks) + [to_normalized_address(account) for account in initial_scenario.accounts]
+    for address in random.sample(addresses, NBR_RANDOM_TESTS) + [initial_scenario.coinbase]:
+        address = to_normalized_address(address)
+        assert index.blocks(address) == address_blocks.get(address, [])
+
+    index.compact(db)
+    assert len(index.segments_meta) == 1
+    address = random.choice(list(address_blocks))
+    assert index.blocks(address) == address_blocks[address]
+    assert [blk.number for blk in index.block_range(db, address)] == address_blocks[address]
+
+
+def test_address_index_reorganisation(initial_scenario, tmpdir):
+    db = initial_scenario.db
+    latest_block_nbr = initial_scenario.get_block()['number']
+    index = AddressIndex(str(tmpdir.join('index')))
+    index.update(db, confirmations=0, segment_blocks=4)
+    index.compact(db)
+    assert [checkpoint[0] for checkpoint in index.segments_meta[0]['checkpoints']] == list(
+        range(3, latest_block_nbr, 4)) + [latest_block_nbr]
+
+    # only the blocks after the last checkpoint before the fork are indexed again
+    fork_blk_nbr = latest_block_nbr - 5
+    last_valid_blk_nbr = max(blk_nbr for blk_nbr in range(3, fork_blk_nbr, 4))
+    reorganised_db = ReorganisedDB(db, fork_blk_nbr)
+    assert index.update(reorganised_db, confirmations=0, segment_blocks=4) == latest_block_nbr - last_valid_blk_nbr
+    assert index.update(reorganised_db, confirmations=0) == 0
+    address_blocks = w3_address_blocks(initial_scenario, latest_block_nbr)
+    for address, blk_nbrs in address_blocks.items():
+        assert index.blocks(address) == blk_nbrs
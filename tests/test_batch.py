@@ -0,0 +1,25 @@
+import logging
+
+import pandas as pd
+
+from ethereum_stats.batch import JobSpec, run_job
+from ethereum_stats.workers import clone_chaindata
+
+
+def test_run_job(initial_scenario, tmpdir):
+    latest_block = initial_scenario.get_block()
+    latest_block_nbr = latest_block['number']
+    # the session keeps its database open, the job plans and runs on a clone of it
+    chaindata = clone_chaindata(initial_scenario.db.dbfile, str(tmpdir.join('chaindata')), 1)
+    spec = JobSpec(chaindata, str(tmpdir.join('output')), output_format='pickle', workers=2, chunk_size=10,
+                   block_ranges=[(1, latest_block_nbr)], state_blocks=[latest_block_nbr],
+                   clone_dir=str(tmpdir.join('clones')))
+    shards = run_job(spec)
+    logging.info('Shards written\n%s', shards)
+
+    df = pd.concat([pd.read_pickle(shard) for shard in shards if 'headers' in shard]).sort_index()
+    assert list(df.index) == list(range(1, latest_block_nbr + 1))
+    assert df.loc[latest_block_nbr].blk_hash == latest_block['hash']
+
+    state_df = pd.read_pickle([shard for shard in shards if 'state' in shard][0])
+    assert initial_scenario.contract_address.lower() in set(state_df.account)
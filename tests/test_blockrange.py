@@ -1,9 +1,10 @@
 from datetime import datetime
 import random
 
-from pytest import raises
+from pytest import approx, raises
 
 from ethereum_stats.blockrange import BlockHeader, BlockRange
+from ethereum_stats.statedataset import BLANK_CODE, BLANK_ROOT
 
 NBR_RANDOM_TESTS = 5
 
@@ -91,9 +92,11 @@ def test_block_range(initial_scenario):
             upper = random.randrange(1, latest_block_nbr)
             if upper > lower:
                 is_proper_range = True
-        for blk in BlockRange(initial_scenario.db, lower, upper):
+        block_range = BlockRange(initial_scenario.db, lower, upper)
+        for blk in block_range:
             w3_blk = initial_scenario.get_block(blk.number)
             compare_blk_hdrs(w3_blk, blk)
+        assert block_range.current_blk_nbr == upper + 1
         with raises(ValueError, message='Lower limit cannot be greater than upper limit'):
             BlockRange(initial_scenario.db, upper, lower)
 
@@ -136,3 +139,53 @@ def test_date_range(initial_scenario):
         # upper_date = datetime.utcfromtimestamp(w3_ts_upper).strftime('%d/%m/%Y')
         # date_range = BlockRange.date_range(test_db, lower_date, upper_date)
         # assert date_range.upper_blk_nbr >= date_range.lower_blk_nbr
+
+
+def test_account_history(initial_scenario):
+    latest_block_nbr = initial_scenario.get_block()['number']
+    lower = max(1, latest_block_nbr - 200)
+    for n in range(NBR_RANDOM_TESTS):
+        account = random.choice(initial_scenario.accounts)
+        history = BlockRange(initial_scenario.db, lower, latest_block_nbr).account_history(account)
+        exact_history = BlockRange(initial_scenario.db, lower, latest_block_nbr).account_history(account, exact=True)
+        assert list(history.index) == list(exact_history.index)
+        assert history.index[0] == lower
+        for blk_nbr in random.sample(range(lower, latest_block_nbr + 1), NBR_RANDOM_TESTS):
+            row = history[history.index <= blk_nbr].iloc[-1]
+            assert row.balance == initial_scenario.get_account_balance(account, blk_nbr)
+            assert row.nonce == initial_scenario.get_account_nonce(account, blk_nbr)
+    # an absent account has the same values as from a remote source
+    missing_history = BlockRange(initial_scenario.db, lower, latest_block_nbr).account_history('0x' + '12' * 20)
+    assert list(missing_history.itertuples(index=False, name=None)) == [(0, 0, BLANK_ROOT, BLANK_CODE, False)]
+
+
+def test_aggregate(initial_scenario):
+    latest_block_nbr = initial_scenario.get_block()['number']
+    lower = random.randrange(1, latest_block_nbr)
+    block_range = BlockRange(initial_scenario.db, lower, latest_block_nbr)
+    df = block_range.aggregate('1min', chunk_size=16)
+    assert df.blocks.sum() == latest_block_nbr - lower + 1
+    assert df.index.is_monotonic_increasing
+
+    headers = BlockRange(initial_scenario.db, lower, latest_block_nbr).to_panda_dataframe()
+    buckets = headers.timestamp // 60 * 60
+    for bucket_start, row in df.iterrows():
+        bucket = headers[buckets == bucket_start.timestamp()]
+        assert row.blocks == len(bucket)
+        assert row.gas_used_mean == approx(bucket.gas_used.mean())
+        assert row.beneficiaries == bucket.beneficiary.nunique()
+
+    with raises(ValueError):
+        block_range.aggregate('1h', metrics=('blocks', 'uncles'))
+
+
+def test_block_range_from_block_numbers(initial_scenario):
+    latest_block_nbr = initial_scenario.get_block()['number']
+    blk_nbrs = random.sample(range(1, latest_block_nbr + 1), NBR_RANDOM_TESTS)
+    block_range = BlockRange.from_block_numbers(initial_scenario.db, blk_nbrs + blk_nbrs[:1])
+    assert [blk.number for blk in block_range] == sorted(blk_nbrs)
+    assert len(block_range.block_hashes()) == len(blk_nbrs)
+    assert list(block_range.to_panda_dataframe().index) == sorted(blk_nbrs)
+    assert block_range.aggregate('1h').blocks.sum() == len(blk_nbrs)
+    with raises(ValueError):
+        BlockRange.from_block_numbers(initial_scenario.db, [])
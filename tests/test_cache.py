@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from ethereum_stats.blockrange import BlockRange
+from ethereum_stats.cache import ResultCache
+
+NBR_ROWS = 1000
+
+
+def sample_frame():
+    df = pd.DataFrame({'number': range(NBR_ROWS),
+                       'blk_hash': ['0x%064x' % n for n in range(NBR_ROWS)],
+                       'difficulty': [2 ** 70 + n for n in range(NBR_ROWS)],
+                       'gas_used': np.arange(NBR_ROWS) * 21000,
+                       'is_contract': np.arange(NBR_ROWS) % 2 == 0})
+    return df.set_index('number')
+
+
+def test_frame_round_trip(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    df = sample_frame()
+    assert cache.get_frame('header_frame', 'abc') is None
+    cache.put_frame('header_frame', 'abc', df)
+    cached_df = cache.get_frame('header_frame', 'abc')
+    assert cached_df.index.name == 'number'
+    pd.testing.assert_frame_equal(cached_df, df)
+    assert cache.get_frame('state_frame', 'abc') is None
+
+
+def test_hit_equals_miss(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    df = pd.DataFrame({'account': ['0x%040x' % n if n % 3 else None for n in range(NBR_ROWS)],
+                       'logs_bloom': ['0x' + '%02x' % (n % 256) * 256 for n in range(NBR_ROWS)],
+                       'extra_data': ['' if n % 2 else '0xd783' for n in range(NBR_ROWS)],
+                       'difficulty': [-1 if n == 0 else 2 ** 70 + n for n in range(NBR_ROWS)],
+                       'balance': np.arange(NBR_ROWS) * 1e18,
+                       'nonce': np.arange(NBR_ROWS, dtype=np.uint64),
+                       'note': ['block %i' % n for n in range(NBR_ROWS)]},
+                      index=pd.Index(['0x%064x' % n for n in range(NBR_ROWS)], name='sha3_account'))
+    cache.put_frame('state_frame', 'abc', df)
+    # strings take one byte per character on disk
+    assert cache.size() < NBR_ROWS * 1000
+    cached_df = cache.get_frame('state_frame', 'abc')
+    pd.testing.assert_frame_equal(cached_df, df)
+    assert cached_df.index.equals(df.index)
+    assert cached_df.loc['0x%064x' % 4].account == '0x%040x' % 4
+    assert list(cached_df.account.str[:6].dropna()) == list(df.account.str[:6].dropna())
+    assert cached_df.nonce.sum() == df.nonce.sum()
+    assert cached_df.difficulty.sum() == df.difficulty.sum()
+
+
+def test_lru_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    cache.put_frame('header_frame', 'key-1', sample_frame())
+    entry_size = cache.size()
+    cache.max_bytes = 2 * entry_size
+    cache.put_frame('header_frame', 'key-2', sample_frame())
+    # a hit makes the first entry the most recently used
+    cache.get_frame('header_frame', 'key-1')
+    cache.put_frame('header_frame', 'key-3', sample_frame())
+    assert cache.size() <= cache.max_bytes
+    assert cache.get_frame('header_frame', 'key-1') is not None
+    assert cache.get_frame('header_frame', 'key-2') is None
+    assert cache.get_frame('header_frame', 'key-3') is not None
+
+
+def test_block_range_cache(initial_scenario, tmpdir):
+    cache = ResultCache(str(tmpdir))
+    latest_block_nbr = initial_scenario.get_block()['number']
+    blk_range = BlockRange(initial_scenario.db, 1, latest_block_nbr)
+    df = blk_range.to_panda_dataframe(cache)
+    cached_df = blk_range.to_panda_dataframe(cache)
+    pd.testing.assert_frame_equal(cached_df, df)
+    assert len(cache.entries()) == 1
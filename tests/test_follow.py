@@ -0,0 +1,106 @@
+import rlp
+from eth_utils import encode_hex, keccak
+
+from ethereum_stats.blockrange import (BlockHeader, BLOCK_HASH_PREFIX, HEADER_PREFIX, LAST_HEADER_KEY, NUM_LEN_BYTES,
+                                       NUM_SUFFIX)
+from ethereum_stats.follow import ADDED, RETRACTED, BlockFollower
+
+
+def test_follow_from_cursor(initial_scenario, tmpdir):
+    test_db = initial_scenario.db
+    latest_block_nbr = BlockHeader.get_latest_block_header_number(test_db)
+    cursor_path = str(tmpdir.join('cursor.json'))
+    follower = BlockFollower(test_db, start_blk_nbr=latest_block_nbr - 10, cursor_path=cursor_path)
+    events = follower.poll()
+    assert [event.kind for event in events] == [ADDED] * 11
+    assert [event.number for event in events] == list(range(latest_block_nbr - 10, latest_block_nbr + 1))
+    for parent, child in zip(events, events[1:]):
+        assert child.header.parent_hash == parent.blk_hash
+    assert events[-1].blk_hash == initial_scenario.get_block(latest_block_nbr)['hash']
+    assert follower.poll() == []
+    follower.save_cursor()
+
+    resumed_follower = BlockFollower(test_db, cursor_path=cursor_path)
+    assert resumed_follower.next_blk_nbr == latest_block_nbr + 1
+    assert resumed_follower.poll() == []
+
+
+class ChainDB(dict):
+    """
+    In memory key value store with the geth layout of the canonical chain, get raises KeyError like LevelDB.
+    """
+
+    def get(self, key):
+        return self[key]
+
+    def set_chain(self, blocks):
+        """
+        Make blocks, a list of (hash, rlp header), the canonical chain from block 0.
+        """
+        for key in [key for key in self if key.startswith(HEADER_PREFIX) and key.endswith(NUM_SUFFIX)]:
+            del self[key]
+        for blk_nbr, (blk_hash, header_rlp) in enumerate(blocks):
+            blk_nbr_big_endian = blk_nbr.to_bytes(NUM_LEN_BYTES, byteorder='big')
+            self[HEADER_PREFIX + blk_nbr_big_endian + NUM_SUFFIX] = blk_hash
+            self[HEADER_PREFIX + blk_nbr_big_endian + blk_hash] = header_rlp
+            self[BLOCK_HASH_PREFIX + blk_hash] = blk_nbr_big_endian
+        self[LAST_HEADER_KEY] = blocks[-1][0]
+
+
+def extend_chain(blocks, nbr_blocks, fork):
+    blocks = list(blocks)
+    for n in range(nbr_blocks):
+        parent_hash = blocks[-1][0] if blocks else bytes(32)
+        header = [parent_hash, bytes(32), bytes(20), bytes(32), bytes(32), bytes(32), bytes(256), 1, len(blocks),
+                  8000000, 0, 1500000000 + 15 * len(blocks), fork, bytes(32), bytes(8)]
+        header_rlp = rlp.encode(header)
+        blocks.append((keccak(header_rlp), header_rlp))
+    return blocks
+
+
+def event_summary(events):
+    return [(event.kind, event.number, event.blk_hash) for event in events]
+
+
+def test_follow_reorganisations(tmpdir):
+    db = ChainDB()
+    main_chain = extend_chain([], 6, b'main')
+    db.set_chain(main_chain)
+    cursor_path = str(tmpdir.join('cursor.json'))
+    follower = BlockFollower(db, start_blk_nbr=1, cursor_path=cursor_path)
+    assert [event.number for event in follower.poll()] == list(range(1, 6))
+    follower.save_cursor()
+
+    # same height fork replacing the last two blocks
+    fork = extend_chain(main_chain[:4], 2, b'fork')
+    db.set_chain(fork)
+    assert event_summary(follower.poll()) == [
+        (RETRACTED, 5, encode_hex(main_chain[5][0])), (RETRACTED, 4, encode_hex(main_chain[4][0])),
+        (ADDED, 4, encode_hex(fork[4][0])), (ADDED, 5, encode_hex(fork[5][0]))]
+
+    # the head moves back to a shorter fork
+    short_fork = extend_chain(fork[:3], 1, b'short')
+    db.set_chain(short_fork)
+    assert event_summary(follower.poll()) == [
+        (RETRACTED, 5, encode_hex(fork[5][0])), (RETRACTED, 4, encode_hex(fork[4][0])),
+        (RETRACTED, 3, encode_hex(fork[3][0])), (ADDED, 3, encode_hex(short_fork[3][0]))]
+    assert follower.poll() == []
+
+    # the canonical chain is read while it changes: block 4 already belongs to a new fork whose block 3 is not
+    # canonical yet, nothing is emitted until both are
+    new_fork = extend_chain(short_fork[:3], 2, b'new')
+    db.set_chain(short_fork[:3] + [short_fork[3], new_fork[4]])
+    assert follower.poll() == []
+    db.set_chain(new_fork)
+    assert event_summary(follower.poll()) == [
+        (RETRACTED, 3, encode_hex(short_fork[3][0])), (ADDED, 3, encode_hex(new_fork[3][0])),
+        (ADDED, 4, encode_hex(new_fork[4][0]))]
+
+    # a follower resumed from the cursor saved before the reorganisations retracts the blocks it had emitted
+    resumed_follower = BlockFollower(db, cursor_path=cursor_path)
+    assert resumed_follower.next_blk_nbr == 6
+    assert event_summary(resumed_follower.poll()) == (
+        [(RETRACTED, blk_nbr, encode_hex(main_chain[blk_nbr][0])) for blk_nbr in range(5, 2, -1)] +
+        [(ADDED, blk_nbr, encode_hex(new_fork[blk_nbr][0])) for blk_nbr in range(3, 5)])
+    resumed_follower.save_cursor()
+    assert BlockFollower(db, cursor_path=cursor_path).next_blk_nbr == 5
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+# seconds allowed to import the header only part of the package in a fresh interpreter
+IMPORT_BUDGET = 1.0
+HEAVY_MODULES = ('numpy', 'pandas', 'ethereum')
+
+IMPORT_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+import ethereum_stats.blockrange
+print(time.perf_counter() - start)
+print(' '.join(name for name in {} if name in sys.modules))
+'''.format(HEAVY_MODULES)
+
+
+def test_blockrange_import_time():
+    timings = []
+    for n in range(3):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], universal_newlines=True).split('\n')
+        timings.append(float(output[0]))
+        assert output[1] == '', 'heavy modules imported: %s' % output[1]
+    assert min(timings) < IMPORT_BUDGET
+
+
+def test_storageexport_does_not_import_leveldb():
+    script = 'import sys\nimport ethereum_stats.storageexport\nprint(\'leveldb\' in sys.modules)'
+    assert subprocess.check_output([sys.executable, '-c', script], universal_newlines=True).strip() == 'False'
@@ -0,0 +1,88 @@
+import random
+
+import rlp
+from pytest import approx, raises
+
+from ethereum_stats.blockrange import BlockHeader
+from ethereum_stats.rlpdecode import decode_accounts, decode_headers, header_fields, list_fields
+from ethereum_stats.statedataset import Account
+
+NBR_RANDOM_TESTS = 50
+
+
+def random_header(blk_nbr):
+    return [random.getrandbits(256).to_bytes(32, 'big'), random.getrandbits(256).to_bytes(32, 'big'),
+            random.getrandbits(160).to_bytes(20, 'big'), random.getrandbits(256).to_bytes(32, 'big'),
+            random.getrandbits(256).to_bytes(32, 'big'), random.getrandbits(256).to_bytes(32, 'big'),
+            bytes(256), random.randrange(1, 2 ** 70), blk_nbr, random.randrange(5000, 8000000),
+            random.randrange(0, 8000000), random.randrange(1438269973, 1600000000),
+            bytes(random.randrange(0, 33)), random.getrandbits(256).to_bytes(32, 'big'),
+            random.getrandbits(64).to_bytes(8, 'big')]
+
+
+def random_account():
+    return [random.choice([0, random.randrange(1, 2 ** 20)]), random.choice([0, 1, random.randrange(1, 2 ** 90)]),
+            random.getrandbits(256).to_bytes(32, 'big'), random.getrandbits(256).to_bytes(32, 'big')]
+
+
+def test_header_fields():
+    for n in range(NBR_RANDOM_TESTS):
+        encoded = rlp.encode(random_header(n))
+        buf, fields = header_fields(encoded)
+        assert [bytes(buf[start:end]) for start, end in fields] == rlp.decode(encoded)
+
+
+def test_block_header_from_rlp():
+    for n in range(NBR_RANDOM_TESTS):
+        header = random_header(n + 1)
+        blk = BlockHeader.from_rlp('0x' + '00' * 32, rlp.encode(header))
+        assert blk.parent_hash == '0x' + header[0].hex()
+        assert blk.beneficiary == '0x' + header[2].hex()
+        assert blk.difficulty == header[7]
+        assert blk.number == header[8]
+        assert blk.gas_used == header[10]
+        assert blk.extra_data == ('0x' + header[12].hex() if header[12] else '')
+        assert blk.nonce == '0x' + header[14].hex()
+
+
+def test_account_from_rlp():
+    for n in range(NBR_RANDOM_TESTS):
+        fields = random_account()
+        account = Account.from_rlp('0x' + '11' * 20, rlp.encode(fields))
+        assert account.nonce == fields[0]
+        assert account.balance == fields[1]
+        assert account.storage_root == '0x' + fields[2].hex()
+        assert account.contract_code == '0x' + fields[3].hex()
+
+
+def test_decode_headers():
+    headers = [random_header(n) for n in range(NBR_RANDOM_TESTS)]
+    # hashes and addresses ending with zero bytes
+    headers[0][0] = b'\x11' * 31 + b'\0'
+    headers[0][2] = b'\x22' * 18 + b'\0\0'
+    columns = decode_headers(b''.join(rlp.encode(header) for header in headers))
+    assert list(columns['number']) == list(range(NBR_RANDOM_TESTS))
+    assert list(columns['gas_used']) == [header[10] for header in headers]
+    assert list(columns['timestamp']) == [header[11] for header in headers]
+    assert list(columns['difficulty']) == approx([header[7] for header in headers])
+    assert [value.tobytes() for value in columns['parent_hash']] == [header[0] for header in headers]
+    assert [value.tobytes() for value in columns['beneficiary']] == [header[2] for header in headers]
+
+
+def test_decode_accounts():
+    accounts = [random_account() for n in range(NBR_RANDOM_TESTS)]
+    accounts[0][3] = b'\x33' * 31 + b'\0'
+    columns = decode_accounts(b''.join(rlp.encode(account) for account in accounts))
+    assert list(columns['nonce']) == [account[0] for account in accounts]
+    assert list(columns['balance']) == approx([account[1] for account in accounts])
+    assert [value.tobytes() for value in columns['code_hash']] == [account[3] for account in accounts]
+    assert [value.tobytes() for value in columns['storage_root']] == [account[2] for account in accounts]
+
+
+def test_invalid_rlp():
+    with raises(ValueError):
+        list_fields(memoryview(rlp.encode(b'not a list')))
+    with raises(ValueError):
+        header_fields(rlp.encode(random_header(1))[:-10])
+    with raises(ValueError):
+        header_fields(rlp.encode(random_header(1)[:10]))
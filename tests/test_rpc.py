@@ -0,0 +1,156 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pytest import raises
+
+from ethereum_stats.blockrange import BlockHeader, BlockRange
+from ethereum_stats.rpc import IPC_READ_SIZE, IPCTransport, RPCError, RPCSource
+from ethereum_stats.statedataset import StateDataset
+
+NBR_BLOCKS = 250
+ADDRESS = '0x' + '11' * 20
+MISSING_ADDRESS = '0x' + '22' * 20
+
+
+def stub_block(blk_nbr):
+    return {'hash': '0x%064x' % (blk_nbr + 1), 'parentHash': '0x%064x' % blk_nbr, 'sha3Uncles': '0x' + 'aa' * 32,
+            'miner': '0x' + '33' * 20, 'stateRoot': '0x%064x' % (blk_nbr + 10 ** 6),
+            'transactionsRoot': '0x' + 'bb' * 32, 'receiptsRoot': '0x' + 'cc' * 32, 'logsBloom': '0x' + '00' * 256,
+            'difficulty': hex(131072 + blk_nbr), 'number': hex(blk_nbr), 'gasLimit': hex(4712388),
+            'gasUsed': hex(21000 * (blk_nbr % 3)), 'timestamp': hex(1500000000 + 15 * blk_nbr), 'extraData': '0x',
+            'mixHash': '0x' + 'dd' * 32, 'nonce': '0x' + 'ee' * 8}
+
+
+def stub_result(method, params):
+    if method == 'eth_blockNumber':
+        return hex(NBR_BLOCKS - 1)
+    if method == 'eth_getBlockByNumber':
+        blk_nbr = NBR_BLOCKS - 1 if params[0] == 'latest' else int(params[0], 16)
+        return stub_block(blk_nbr) if blk_nbr < NBR_BLOCKS else None
+    if method in ('eth_getBalance', 'eth_getTransactionCount', 'eth_getProof'):
+        blk_nbr = NBR_BLOCKS - 1 if params[-1] == 'latest' else int(params[-1], 16)
+        known = params[0] == ADDRESS
+        balance = hex(10 ** 18 + blk_nbr if known else 0)
+        nonce = hex(blk_nbr // 10 if known else 0)
+        if method == 'eth_getBalance':
+            return balance
+        if method == 'eth_getTransactionCount':
+            return nonce
+        return {'address': params[0], 'accountProof': [], 'balance': balance, 'nonce': nonce,
+                'codeHash': '0x' + '00' * 32, 'storageHash': '0x' + '00' * 32, 'storageProof': []}
+    raise ValueError(method)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    batches = []
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        StubHandler.batches.append(len(request))
+        response = []
+        for call in request:
+            try:
+                response.append({'jsonrpc': '2.0', 'id': call['id'],
+                                 'result': stub_result(call['method'], call['params'])})
+            except ValueError:
+                response.append({'jsonrpc': '2.0', 'id': call['id'],
+                                 'error': {'code': -32601, 'message': 'method not found'}})
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rpc_source():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.batches = []
+    source = RPCSource('http://127.0.0.1:%i' % server.server_address[1], batch_size=20, max_concurrency=3)
+    yield source
+    source.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_block_header(rpc_source):
+    blk = BlockHeader.get_block_header_by_number(rpc_source, 42)
+    assert blk.number == 42
+    assert blk.blk_hash == '0x%064x' % 43
+    assert blk.parent_hash == '0x%064x' % 42
+    assert blk.difficulty == 131072 + 42
+    assert blk.timestamp == 1500000000 + 15 * 42
+    assert blk.extra_data == ''
+    assert BlockHeader.get_latest_block_header_number(rpc_source) == NBR_BLOCKS - 1
+    assert BlockHeader.get_latest_block_header(rpc_source).number == NBR_BLOCKS - 1
+    assert BlockHeader.get_block_number_by_timestamp(rpc_source, 1500000000 + 15 * 100 + 7, True) == 100
+
+
+def test_block_range_batches(rpc_source):
+    numbers = [blk.number for blk in BlockRange(rpc_source, 3, NBR_BLOCKS - 1)]
+    assert numbers == list(range(3, NBR_BLOCKS))
+    assert max(StubHandler.batches) == 20
+    assert len(StubHandler.batches) == -(-(NBR_BLOCKS - 3) // 20)
+    with raises(KeyError):
+        rpc_source.get_block_header_by_number(NBR_BLOCKS)
+
+
+def test_get_account(rpc_source):
+    state = StateDataset(rpc_source, stub_block(100)['stateRoot'], 100)
+    account = state.get_account(ADDRESS)
+    assert account.is_in_db
+    assert account.balance == 10 ** 18 + 100
+    assert account.nonce == 10
+    assert not account.is_contract
+    assert not state.get_account(MISSING_ADDRESS).is_in_db
+    assert rpc_source.get_balances([ADDRESS, MISSING_ADDRESS], 100) == [10 ** 18 + 100, 0]
+    assert rpc_source.get_nonces([ADDRESS] * 50) == [(NBR_BLOCKS - 1) // 10] * 50
+    with raises(ValueError):
+        StateDataset(rpc_source, stub_block(100)['stateRoot'])
+    for walk in (state.to_dict, state.to_panda_dataframe, lambda: state.aggregate([]), lambda: state.sample(10)):
+        with raises(ValueError, match='local database'):
+            walk()
+
+
+def test_rpc_error(rpc_source):
+    with raises(RPCError):
+        rpc_source.call('eth_unknownMethod')
+
+
+def test_ipc_response_in_chunks(tmpdir):
+    path = str(tmpdir.join('geth.ipc'))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    # the multi-byte character and the closing brackets arrive in separate chunks
+    body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': 'café ' * 10}, ensure_ascii=False).encode() + b'\n'
+    split = body.index('é'.encode()) + 1
+
+    def serve():
+        connection, _ = server.accept()
+        connection.recv(IPC_READ_SIZE)
+        for chunk in (body[:split], body[split:-3], body[-3:]):
+            connection.sendall(chunk)
+            time.sleep(0.05)
+        connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    transport = IPCTransport(path)
+    try:
+        assert transport.request(b'{}')['result'] == 'café ' * 10
+    finally:
+        transport.close()
+        server.close()
+    thread.join()
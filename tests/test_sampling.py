@@ -0,0 +1,55 @@
+import random
+
+import rlp
+from eth_utils import decode_hex, keccak
+
+from ethereum_stats.sampling import StateSample
+from ethereum_stats.statedataset import BLANK_CODE, BLANK_ROOT, StateDataset
+
+# hex prefix flag of a leaf with an even number of nibbles
+LEAF_FLAG = b'\x20'
+
+
+def single_account_state(balance):
+    """
+    State whose root is the leaf of its only account.
+    """
+    account_rlp = rlp.encode([1, balance, decode_hex(BLANK_ROOT), decode_hex(BLANK_CODE)])
+    root_node = rlp.encode([LEAF_FLAG + keccak(b'account'), account_rlp])
+    root = keccak(root_node)
+    return StateDataset({root: root_node}, root)
+
+
+def test_sample_single_account_state():
+    state = single_account_state(10 ** 18)
+    nbr_covered = 0
+    for seed in range(20):
+        sample = state.sample(20, seed=seed, resolve_addresses=False)
+        count, low, high = sample.estimate_count()
+        assert high < float('inf')
+        nbr_covered += low <= 1 <= high
+        assert sample.mean('balance')[0] == 10 ** 18
+        assert sample.fraction('is_contract')[0] == 0
+        assert sample.quantile('balance', 0.5)[0] == 10 ** 18
+    # 95% intervals
+    assert nbr_covered >= 17
+
+
+def test_estimate_count_without_shared_prefix():
+    sample = StateSample([None] * 10, [0] * 10)
+    count, low, high = sample.estimate_count()
+    assert low <= count <= high < float('inf')
+    assert sample.effective_size > 0
+
+
+def test_estimate_count_of_random_keys():
+    rng = random.Random(1)
+    nbr_keys = 5000
+    keys = [rng.getrandbits(256) for n in range(nbr_keys)]
+    matched_nibbles = []
+    for n in range(500):
+        key = rng.getrandbits(256)
+        # nibbles in common with the closest key
+        matched_nibbles.append(max((256 - (key ^ k).bit_length()) // 4 for k in keys))
+    count, low, high = StateSample([None] * 500, matched_nibbles).estimate_count()
+    assert low <= nbr_keys <= high
@@ -1,9 +1,13 @@
 import logging
+import os
 import random
+import statistics
 
 from eth_utils import decode_hex
 
-from ethereum_stats.statedataset import StateDataset
+from ethereum_stats.aggregators import Count, Sum, TopK, QuantileSketch, LogHistogram, Gini
+from ethereum_stats.statedataset import BLANK_CODE, StateDataset
+from ethereum_stats.storageexport import export_storage
 
 NBR_RANDOM_TESTS = 5
 
@@ -118,3 +122,88 @@ def test_contract_storage_size_on_latest(initial_scenario):
     logging.info('w3 code size %i  on acc: %s on latest blk', contract_size, contract_address)
     contract = state.get_account(contract_address)
     assert contract_size == contract.storage_size(db)
+
+
+def test_aggregate_on_latest(initial_scenario):
+    block = initial_scenario.get_block()
+    db = initial_scenario.db
+    state = StateDataset(db, decode_hex(block.stateRoot))
+    state_dict = state.to_dict()
+    balances = [acc[1] for acc in state_dict.values()]
+
+    aggregators = [Count(), Count('is_contract'), Sum('balance'), TopK('balance', 3), LogHistogram('balance'),
+                   QuantileSketch('balance'), Gini('balance')]
+    results = state.aggregate(aggregators)
+    logging.info('Aggregations\n%s', results)
+    assert results['count'] == len(state_dict)
+    assert results['count_is_contract'] >= 1
+    assert results['sum_balance'] == sum(balances)
+    assert [value for address, value in results['topk_balance']] == sorted(balances, reverse=True)[:3]
+    assert sum(results['loghistogram_balance'].values()) == len(state_dict)
+    assert 0 <= results['gini_balance'] <= 1
+
+    shards = []
+    for nibble in range(16):
+        shard_aggregators = [Count(), Sum('balance')]
+        state.aggregate(shard_aggregators, prefix=(nibble,))
+        shards.append(shard_aggregators)
+    count, total = shards[0]
+    for shard_count, shard_total in shards[1:]:
+        count.merge(shard_count)
+        total.merge(shard_total)
+    assert count.result() == len(state_dict)
+    assert total.result() == sum(balances)
+
+
+def test_export_storage_on_latest(initial_scenario, tmpdir):
+    import pandas as pd
+
+    block = initial_scenario.get_block()
+    db = initial_scenario.db
+    state = StateDataset(db, decode_hex(block.stateRoot))
+    contract_address = initial_scenario.contract_address
+    paths = state.export_storage(str(tmpdir), addresses=[contract_address], nbr_workers=1)
+    df = pd.concat([pd.read_parquet(path) for path in paths])
+    logging.info('Storage of %s\n%s', contract_address, df)
+    assert set(df.contract) == {contract_address.lower()}
+    assert len(df) == initial_scenario.contract_storage_size
+    assert df.slot_hash.is_unique
+
+    all_paths = state.export_storage(str(tmpdir.join('all')), nbr_workers=2, clone_dir=str(tmpdir.join('clones')))
+    all_df = pd.concat([pd.read_parquet(path) for path in all_paths])
+    # the storage roots of a worker share its files
+    assert len(all_paths) <= 2
+    assert len(all_df[all_df.contract == contract_address.lower()]) == initial_scenario.contract_storage_size
+
+    batch_paths = export_storage(state, str(tmpdir.join('batches')), addresses=[contract_address], nbr_workers=1,
+                                 batch_size=5)
+    assert [os.path.basename(path) for path in batch_paths] == ['storage-000-%05i.parquet' % n for n in
+                                                                 range(len(batch_paths))]
+    assert [len(pd.read_parquet(path)) for path in batch_paths[:-1]] == [5] * (len(batch_paths) - 1)
+    assert len(pd.concat([pd.read_parquet(path) for path in batch_paths])) == initial_scenario.contract_storage_size
+
+
+def test_sample_on_latest(initial_scenario):
+    block = initial_scenario.get_block()
+    state = StateDataset(initial_scenario.db, decode_hex(block.stateRoot))
+    state_dict = state.to_dict()
+
+    sample = state.sample(2000, seed=1)
+    assert len(sample) == 2000
+    assert all(account.address in state_dict for account in sample.accounts)
+    same_seed_sample = state.sample(2000, seed=1)
+    assert [account.address for account in sample.accounts] == [account.address for account in
+                                                                same_seed_sample.accounts]
+
+    count, low, high = sample.estimate_count()
+    logging.info('Estimated %.0f accounts in [%.0f, %.0f], %i in state', count, low, high, len(state_dict))
+    assert low <= len(state_dict) <= high
+
+    contracts = [acc[3] != BLANK_CODE for acc in state_dict.values()]
+    fraction, low, high = sample.fraction('is_contract')
+    assert low <= sum(contracts) / len(contracts) <= high
+    balances = [acc[1] for acc in state_dict.values()]
+    median, low, high = sample.quantile('balance', 0.5)
+    assert low <= statistics.median_low(balances) <= high
+    mean, low, high = sample.mean('balance')
+    assert low <= statistics.mean(balances) <= high